@@ -1,12 +1,31 @@
 import streamlit as st
+import streamlit.components.v1 as components
+from streamlit.errors import StreamlitAPIException
 import os
 import subprocess
-from streamlit_pdf_viewer import pdf_viewer
-from github import Github, Auth
+import time
+import functools
+import hmac
+import secrets
+import threading
+from PIL import Image, ImageOps
 import shutil
+import mmap
+import requests
+import hashlib
+import html
+import re
+from urllib.parse import quote
+from concurrent.futures import ThreadPoolExecutor
+from collections import Counter, defaultdict, deque
+import xxhash
+from pygments import highlight
+from pygments.lexers import TexLexer
+from pygments.formatters import HtmlFormatter
 # Removed: from cryptography.fernet import Fernet
 
 # --- HELPER FUNCTION ---
+@functools.lru_cache(maxsize=32) # Secrets don't change while the server runs
 def get_secret(key):
     # 1. Priority: Check Environment Variables (Render)
     if key in os.environ:
@@ -16,7 +35,7 @@ def get_secret(key):
     try:
         if key in st.secrets:
             return st.secrets[key]
-    except Exception:
+    except (FileNotFoundError, StreamlitAPIException): # No or unreadable secrets.toml
         pass
 
     return None
@@ -28,14 +47,73 @@ BASE_DIRS = {
     "Year": "year"
 }
 
-TEMP_DIR = "temp_build"
+# Build in RAM when tmpfs is available, so pdflatex's aux/log/pdf I/O never hits disk
+if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+    TEMP_DIR = "/dev/shm/spo_build"
+else:
+    TEMP_DIR = "temp_build"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Compiled PDFs are published here; Streamlit serves them at app/static/pdfs/ for the
+# viewer iframe. Static files skip the login check: anyone with a URL can fetch the PDF.
+# Each session publishes under its own random name (see publish_pdf), so a URL can't be
+# derived from a document, but one that leaks (history, a shared link) works until swept.
+STATIC_PDF_DIR = os.path.join("static", "pdfs")
+os.makedirs(STATIC_PDF_DIR, exist_ok=True)
+
+# latexmk reruns pdflatex until references/TOC settle; plain pdflatex is the fallback
+LATEXMK = shutil.which("latexmk")
+LOG_TAIL_LINES = 400 # Only the end of a pdflatex log is kept for the error view
+BUILD_JOB_NAME = "_build" # Output name inside a document's build folder
+# Stop at the first error (nothing useful follows it) and never run shell commands.
+# nonstopmode rather than batchmode: the error view is built from the terminal output.
+LATEX_FLAGS = ["-interaction=nonstopmode", "-halt-on-error", "-no-shell-escape", "-file-line-error"]
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Large images get a downscaled copy here (at sync or first compile), which pdflatex finds before the original
+IMAGE_CACHE_DIR = "image_cache"
+IMAGE_MAX_SIZE = (1600, 1600)
+IMAGE_OPTIMIZE_MIN_BYTES = 200 * 1024
+
+# Format with the common packages preloaded (built from spo_preamble.ltx in the Docker image)
+SPO_FMT = os.path.abspath("spo.fmt")
+FMT_ARGS = [f"-fmt={SPO_FMT}"] if os.path.exists(SPO_FMT) else []
+# Dumps of preambles several documents share. They run to megabytes, so they live on disk
+# (not TEMP_DIR's tmpfs) and only the most used ones get a format at all.
+PREAMBLE_FMT_DIR = "fmt_cache"
+PREAMBLE_FMT_MAX_ENTRIES = 8
+
 st.set_page_config(page_title="JPJC SPhO Archive", layout="wide")
 
 # ==========================================
 # 🔐 AUTHENTICATION LOGIC
 # ==========================================
+ROLE_LABELS = {"admin": "Administrator", "viewer": "Viewer"}
+
+@st.cache_resource
+def get_password_table():
+    """
+    SHA-256 digest of each role's password, built once per process; unset roles are
+    left out. <role>_password_sha256 (hex) is preferred, so the plain password need
+    not be stored; <role>_password still works. A malformed hash locks its role out.
+    """
+    table = {}
+    for role in ROLE_LABELS:
+        hashed = get_secret(f"{role}_password_sha256")
+        password = get_secret(f"{role}_password")
+        if hashed is not None:
+            try:
+                digest = bytes.fromhex(str(hashed).strip())
+                if len(digest) != hashlib.sha256().digest_size:
+                    raise ValueError("not a SHA-256 digest")
+            except ValueError as e:
+                print(f"⚠️ Ignoring {role}_password_sha256: {e}")
+                continue
+            table[role] = digest
+        elif password is not None:
+            table[role] = hashlib.sha256(str(password).encode()).digest()
+    return table
+
 def check_login():
     if "user_role" not in st.session_state:
         st.session_state.user_role = None
@@ -51,13 +129,15 @@ def check_login():
         submit_button = st.form_submit_button("Login")
 
         if submit_button:
-            if password_input == get_secret("admin_password"):  
-                st.session_state.user_role = "admin"
-                st.success("Logged in as Administrator")
-                st.rerun()
-            elif password_input == get_secret("viewer_password"):  
-                st.session_state.user_role = "viewer"
-                st.success("Logged in as Viewer")
+            digest = hashlib.sha256(password_input.encode()).digest()
+            role = None
+            # Compare against every role, so the time taken doesn't reveal which one matched
+            for candidate, expected in get_password_table().items():
+                if hmac.compare_digest(digest, expected) and role is None:
+                    role = candidate
+            if role:
+                st.session_state.user_role = role
+                st.success(f"Logged in as {ROLE_LABELS[role]}")
                 st.rerun()
             else:
                 st.error("❌ Invalid Password")
@@ -69,142 +149,746 @@ if not current_role: st.stop()
 # ==========================================
 # 🐙 GITHUB SYNC (MULTI-FOLDER)
 # ==========================================
+# Rate-limited requests wait for the reset, but never stall the page longer than this
+GITHUB_MAX_RATE_LIMIT_WAIT = 120
+# Parallel file downloads in a sync; the session pools one connection per worker
+DOWNLOAD_WORKERS = 16
+DOWNLOAD_CHUNK_SIZE = 64 * 1024 # Bytes held in memory per download at a time
+
+def github_retry():
+    """PyGithub's retry policy: sleeps out rate limits (403/429) and retries server errors."""
+    # PyGithub is imported on first use: page views that never sync or push skip loading it
+    from github import GithubRetry
+    return GithubRetry(max_rate_limit_wait=GITHUB_MAX_RATE_LIMIT_WAIT, status_forcelist=[429, *range(500, 600)])
+
+@st.cache_resource(show_spinner=False)
+def get_github_repo():
+    """PyGithub repo handle, built once per process instead of once per push."""
+    from github import Github, Auth
+    return Github(auth=Auth.Token(get_secret("github_token")), retry=github_retry()).get_repo(get_secret("github_repo"))
+
+@st.cache_resource(show_spinner=False)
+def get_remote_shas():
+    """{path: blob sha} as of the last sync or push, shared by all sessions."""
+    return {}
+
 def push_to_github(local_path, content, commit_message):
     """
     Pushes content directly to GitHub (No Encryption).
     local_path example: 'Year/2023/exam.tex'
+    One file is just a batch of one; see push_many.
     """
+    return push_many([(local_path, content)], commit_message)
+
+def push_many(changes, commit_message):
+    """
+    Pushes several (path, content) pairs as one commit: a tree, a commit and a ref
+    update, however many files there are (update_file costs a call or two per file).
+    Files GitHub already has byte for byte are left out; if nothing is left, no
+    commit is made.
+    """
+    from github import GithubException, InputGitTreeElement
     try:
-        auth_token = Auth.Token(get_secret("github_token"))
-        g = Github(auth=auth_token)
-        repo = g.get_repo(get_secret("github_repo"))
-        
-        # 1. GET CONTENT REF
-        # We need to get the file to update it (sha is required)
-        contents = repo.get_contents(local_path, ref=get_secret("github_branch"))
-        
-        # 2. PUSH DIRECTLY
-        repo.update_file(
-            path=contents.path,
-            message=commit_message,
-            content=content, # Send plain string
-            sha=contents.sha,
-            branch=get_secret("github_branch")
-        )
-        return True, "Successfully pushed to GitHub!"
+        repo = get_github_repo()
+        remote_shas = get_remote_shas()
+        blob_shas = {path: git_blob_sha_of(content.encode("utf-8")) for path, content in changes}
+        changes = [(path, content) for path, content in changes if remote_shas.get(path) != blob_shas[path]]
+        if not changes:
+            return True, "GitHub already has this version; nothing to push."
+        elements = [InputGitTreeElement(path, "100644", "blob", content=content) for path, content in changes]
+        ref = repo.get_git_ref(f"heads/{get_secret('github_branch')}")
+        for attempt in range(2):
+            parent = repo.get_git_commit(ref.object.sha)
+            tree = repo.create_git_tree(elements, parent.tree)
+            if tree.sha == parent.tree.sha:
+                break # Same files as the branch head: an empty commit would change nothing
+            commit = repo.create_git_commit(commit_message, tree, [parent])
+            try:
+                ref.edit(commit.sha) # Not forced: fails if the branch moved meanwhile
+                break
+            except GithubException as e:
+                if attempt or e.status != 422:
+                    raise
+                # Someone pushed in between: rebuild once on top of their commit
+                ref = repo.get_git_ref(f"heads/{get_secret('github_branch')}")
+        remote_shas.update((path, blob_shas[path]) for path, content in changes)
+        if len(changes) == 1:
+            return True, "Successfully pushed to GitHub!"
+        return True, f"Successfully pushed {len(changes)} files to GitHub!"
     except Exception as e:
         return False, f"GitHub Error: {str(e)}"
 
+def download_raw_file(session, repo_name, branch, path):
+    """Streams one file from raw.githubusercontent.com to path (no base64, never whole in memory)."""
+    url = f"https://raw.githubusercontent.com/{repo_name}/{quote(branch)}/{quote(path)}"
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status()
+        write_file(path, response.iter_content(DOWNLOAD_CHUNK_SIZE))
+
+def list_remote_tree(session, repo_name, branch):
+    """Returns the branch's recursive Git tree as plain JSON (one API call)."""
+    url = f"https://api.github.com/repos/{repo_name}/git/trees/{quote(branch)}"
+    response = session.get(url, params={"recursive": "1"}, timeout=60)
+    response.raise_for_status()
+    return response.json()
+
+def write_file(path, chunks):
+    """
+    Writes byte chunks straight through os.write, without a buffered file object.
+    They go to a .part file that replaces path at the end, so a failed download
+    leaves the previous version in place.
+    """
+    part_path = f"{path}.part"
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        for chunk in chunks:
+            view = memoryview(chunk)
+            while view:
+                view = view[os.write(fd, view):]
+    except BaseException:
+        os.close(fd)
+        remove_quietly(part_path) # Its FileNotFoundError would hide the real error
+        raise
+    os.close(fd)
+    os.replace(part_path, path)
+
+def git_blob_sha_of(data):
+    """Git's object id for some bytes: sha1 over 'blob <size>\\0' + content."""
+    h = hashlib.sha1(f"blob {len(data)}\0".encode())
+    h.update(data)
+    return h.hexdigest()
+
+def git_blob_sha(path):
+    """Git's object id for a local file."""
+    with open(path, "rb") as f:
+        return git_blob_sha_of(f.read())
+
+def dir_is_empty(path):
+    """True if path has no entries; stops at the first one instead of listing them all."""
+    with os.scandir(path) as it:
+        return next(it, None) is None
+
+def optimize_image(path):
+    """Writes a downscaled, EXIF-free copy of a large image to IMAGE_CACHE_DIR."""
+    cached_path = os.path.join(IMAGE_CACHE_DIR, path)
+    if os.path.getsize(path) < IMAGE_OPTIMIZE_MIN_BYTES:
+        if os.path.exists(cached_path):
+            os.remove(cached_path)
+        return
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    # Written aside and renamed, so a concurrent pdflatex never reads half an image
+    tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+    with Image.open(path) as original:
+        img_format = original.format
+        img = ImageOps.exif_transpose(original) # Keep the orientation once EXIF is dropped
+        img.thumbnail(IMAGE_MAX_SIZE)
+        if img_format == "JPEG":
+            img.save(tmp_path, "JPEG", quality=85, optimize=True)
+        else:
+            img.save(tmp_path, "PNG", optimize=True)
+    os.replace(tmp_path, cached_path)
+
+def optimize_folder_images(folder):
+    """
+    Optimizes the folder's images that have no up-to-date copy in IMAGE_CACHE_DIR yet,
+    e.g. ones shipped in the Docker image or left alone by a sync.
+    """
+    with os.scandir(folder) as it:
+        images = [e for e in it if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS)]
+    for e in images:
+        path = os.path.relpath(e.path)
+        try:
+            if os.stat(os.path.join(IMAGE_CACHE_DIR, path)).st_mtime_ns >= e.stat().st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass # No copy yet (small images never get one; optimize_image just returns)
+        try:
+            optimize_image(path)
+        except Exception as image_error:
+            print(f"⚠️ Could not optimize {path}: {image_error}")
+
 def pull_from_github():
     """
-    Loops through BASE_DIRS, wipes them locally, and re-downloads from GitHub.
-    Robustly handles file encodings.
+    Syncs BASE_DIRS with GitHub, downloading only new or changed files.
+    One Git Trees call lists every file; downloads then run in parallel.
     """
     try:
-        auth_token = Auth.Token(get_secret("github_token"))
-        g = Github(auth=auth_token)
-        repo = g.get_repo(get_secret("github_repo"))
+        token = get_secret("github_token")
+        repo_name = get_secret("github_repo")
+        branch = get_secret("github_branch")
+        # PyGithub is only needed for pushes; syncing talks to GitHub directly
+        session = requests.Session()
+        session.headers.update({"Authorization": f"Bearer {token}"})
+        # Same rate-limit handling as PyGithub, and one pooled connection per download worker
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=DOWNLOAD_WORKERS, max_retries=github_retry()))
         
-        total_files = 0
+        # 1. List every file (with its blob sha) under "topics" and "Year" in a single request
+        tree = list_remote_tree(session, repo_name, branch)
+        # A truncated listing is missing files that do exist, so nothing is deleted on its word
+        truncated = bool(tree.get("truncated"))
+        if truncated:
+            print("Warning: GitHub truncated the file tree; skipping local deletions.")
+        prefixes = tuple(f"{folder_name}/" for folder_name in BASE_DIRS.values())
+        remote = {e["path"]: e["sha"] for e in tree["tree"] if e["type"] == "blob" and e["path"].startswith(prefixes)}
+        remote_shas = get_remote_shas()
+        if not truncated:
+            remote_shas.clear()
+        remote_shas.update(remote)
         
-        # Iterate over "topics" and "Year"
+        # 2. Remove local files (and emptied folders) that no longer exist on GitHub
+        local_paths = set()
         for label, folder_name in BASE_DIRS.items():
-            
-            # 1. Wipe Local Folder
-            if os.path.exists(folder_name):
-                shutil.rmtree(folder_name)
             os.makedirs(folder_name, exist_ok=True)
-            
-            # 2. Get Contents from GitHub
+            for root, dirs, files in os.walk(folder_name):
+                local_paths.update(os.path.join(root, f).replace("\\", "/") for f in files)
+        if not truncated:
+            for local_path in local_paths - remote.keys():
+                os.remove(local_path)
+                cached_path = os.path.join(IMAGE_CACHE_DIR, local_path)
+                if os.path.exists(cached_path):
+                    os.remove(cached_path)
+            for label, folder_name in BASE_DIRS.items():
+                for root, dirs, files in os.walk(folder_name, topdown=False):
+                    if root != folder_name and dir_is_empty(root):
+                        os.rmdir(root)
+        
+        # 3. Git blob shas are content hashes: unchanged files are skipped
+        paths = [p for p, sha in remote.items() if p not in local_paths or git_blob_sha(p) != sha]
+        for folder in {os.path.dirname(p) for p in paths}:
+            os.makedirs(folder, exist_ok=True)
+        
+        # 4. Parallel download; each worker also writes (and optimizes) its own file
+        def fetch(path):
             try:
-                contents = repo.get_contents(folder_name, ref=get_secret("github_branch"))
-            except Exception as e:
-                # If folder doesn't exist on GitHub, just skip it
-                print(f"Warning: {folder_name} not found. {e}")
-                continue
-
-            # 3. Recursive Download
-            while contents:
-                file_content = contents.pop(0)
-                if file_content.type == "dir":
-                    contents.extend(repo.get_contents(file_content.path, ref=get_secret("github_branch")))
-                else:
-                    local_path = file_content.path 
-                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                    
-                    # --- ROBUST CONTENT DECODING ---
-                    try:
-                        # Case A: Standard Base64 encoded file
-                        if file_content.encoding == "base64":
-                            raw_data = file_content.decoded_content
-                        
-                        # Case B: 'none' encoding (often empty files or raw text)
-                        elif file_content.encoding == "none" or file_content.encoding is None:
-                            # Treat content as string, encode to bytes. If None, use empty bytes.
-                            raw_data = (file_content.content or "").encode('utf-8')
-                        
-                        # Case C: Fallback for anything else
-                        else:
-                            raw_data = file_content.decoded_content
-                            
-                    except Exception as decode_error:
-                        # Log error to console but don't crash the app
-                        print(f"⚠️ Error downloading {local_path}: {decode_error}")
-                        continue
-
-                    # Write bytes to disk
-                    with open(local_path, "wb") as f:
-                        f.write(raw_data)
-                    total_files += 1
+                download_raw_file(session, repo_name, branch, path)
+            except Exception as download_error:
+                # Log error to console but don't crash the app
+                print(f"⚠️ Error downloading {path}: {download_error}")
+                return False
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                try:
+                    optimize_image(path)
+                except Exception as image_error:
+                    print(f"⚠️ Could not optimize {path}: {image_error}")
+            return True
+        
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            total_files = sum(pool.map(fetch, paths))
                     
-        return True, f"Sync complete! Processed {total_files} files."
+        unchanged = len(remote) - len(paths)
+        # Drop listings cached for the pre-sync folder versions
+        get_subfolders.clear()
+        get_files.clear()
+        get_shared_preamble_keys.clear()
+        msg = f"Sync complete! Downloaded {total_files} files ({unchanged} already up to date)."
+        if truncated:
+            msg += " GitHub returned a partial file list, so no local files were removed."
+        return True, msg
     except Exception as e:
         return False, str(e)
 
-# --- AUTO-PULL CHECK ---
-# If "topics" is missing, we assume we need to pull everything
-if not os.path.exists(BASE_DIRS["Topics"]) or not os.listdir(BASE_DIRS["Topics"]):
-    pull_from_github()
-
 # ==========================================
 # 🚀 HELPER FUNCTIONS
 # ==========================================
 
-def get_subfolders(root_dir):
-    """Returns list of subfolders (e.g., 'Kinematics', '2023')"""
+def dir_mtime(path):
+    """Folder mtime in ns (0 if missing); it changes when an entry is added, removed or renamed."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_subfolders(root_dir, mtime_ns):
+    """Returns list of subfolders (e.g., 'Kinematics', '2023'); mtime_ns keys the cache"""
     if not os.path.exists(root_dir): return []
-    return sorted([d for d in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, d))])
+    with os.scandir(root_dir) as it:
+        return sorted(e.name for e in it if e.is_dir())
 
-def get_files(root_dir, subfolder):
-    """Returns list of supported files in the specific subfolder"""
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_files(root_dir, subfolder, mtime_ns):
+    """Returns list of supported files in the specific subfolder; mtime_ns keys the cache"""
     target_path = os.path.join(root_dir, subfolder)
     allowed_extensions = ('.tex', '.pdf', '.jpg', '.jpeg', '.png')
-    return sorted([f for f in os.listdir(target_path) if f.lower().endswith(allowed_extensions)])
+    with os.scandir(target_path) as it:
+        return sorted(e.name for e in it if e.is_file() and e.name.lower().endswith(allowed_extensions))
 
-def compile_latex(file_path):
-    file_name = os.path.basename(file_path)
-    job_name = os.path.splitext(file_name)[0]
-    abs_temp_dir = os.path.abspath(TEMP_DIR)
-    
+# --- AUTO-PULL CHECK ---
+# If "topics" is missing, we assume we need to pull everything
+if not os.path.exists(BASE_DIRS["Topics"]) or dir_is_empty(BASE_DIRS["Topics"]):
+    pull_from_github()
+
+PDF_CACHE_TTL = 24 * 3600     # Seconds a compiled PDF survives after its last use
+PDF_CACHE_MAX_ENTRIES = 200   # Most recently used PDFs kept in TEMP_DIR
+PDF_IN_USE_SECONDS = 3600     # PDFs used this recently are never evicted to meet the cap
+SWEEP_INTERVAL = 15 * 60      # Seconds between sweeps triggered by compiles
+
+@st.cache_resource(show_spinner=False)
+def get_source_keys():
+    """Process-wide {source_path: (signature, key, inputs)} memo that survives reruns."""
+    return {}
+
+INPUT_COMMANDS = re.compile(rb"\\(?:input|include|subfile)\s*\{([^}]+)\}")
+
+def find_inputs(file_path):
+    """
+    Files a .tex pulls in with \\input/\\include, followed recursively. Missing ones are
+    listed too, so their later appearance changes the signature.
+    """
+    folder = os.path.dirname(file_path)
+    inputs, pending = set(), [file_path]
+    while pending:
+        with open(pending.pop(), "rb") as f:
+            names = INPUT_COMMANDS.findall(f.read())
+        for name in names:
+            path = os.path.normpath(os.path.join(folder, name.decode("utf-8", "replace").strip()))
+            if not os.path.splitext(path)[1]:
+                path += ".tex"
+            if path not in inputs and path != file_path:
+                inputs.add(path)
+                if os.path.isfile(path):
+                    pending.append(path)
+    return sorted(inputs)
+
+def source_signature(file_path, inputs):
+    """(path, mtime, size) of the .tex, its inputs and its sibling images; None if gone."""
+    with os.scandir(os.path.dirname(file_path)) as it:
+        images = sorted(e.path for e in it if e.name.lower().endswith(IMAGE_EXTENSIONS))
+    signature = []
+    for p in [file_path, *inputs, *images]:
+        try:
+            s = os.stat(p)
+            signature.append((p, s.st_mtime_ns, s.st_size))
+        except FileNotFoundError:
+            signature.append((p, None, None))
+    return tuple(signature)
+
+def get_source_key(file_path):
+    """
+    Returns an xxHash64 of the .tex file, the files it \\inputs and its sibling images.
+    Re-hashing is skipped while their mtimes and sizes are unchanged.
+    """
+    memo = get_source_keys()
+    cached = memo.get(file_path)
+    if cached and cached[0] == source_signature(file_path, cached[2]):
+        return cached[1]
+
+    # Something changed (possibly the list of inputs itself): look for inputs again
+    inputs = find_inputs(file_path)
+    signature = source_signature(file_path, inputs)
+    folder = os.path.dirname(file_path)
+    h = xxhash.xxh64()
+    for p, mtime, size in signature:
+        if size is None:
+            continue
+        h.update(os.path.relpath(p, folder).encode("utf-8"))
+        with open(p, "rb") as f:
+            h.update(f.read())
+    key = h.hexdigest()
+    memo[file_path] = (signature, key, inputs)
+    return key
+
+def remove_quietly(path):
     try:
-        process = subprocess.run(
+        os.remove(path)
+    except FileNotFoundError:
+        pass # Another session already removed it
+
+def sweep_build_dir():
+    """
+    Drops build files/folders unused for PDF_CACHE_TTL, then keeps the newest
+    PDF_CACHE_MAX_ENTRIES PDFs, sparing any used in the last PDF_IN_USE_SECONDS
+    (a session may still be showing it).
+    """
+    now = time.time()
+    for folder in (TEMP_DIR, STATIC_PDF_DIR):
+        pdfs = []
+        with os.scandir(folder) as it:
+            for e in it:
+                if e.is_dir():
+                    if now - e.stat().st_mtime > PDF_CACHE_TTL:
+                        shutil.rmtree(e.path, ignore_errors=True)
+                    continue
+                mtime = e.stat().st_mtime
+                if now - mtime > PDF_CACHE_TTL:
+                    remove_quietly(e.path)
+                elif e.name.endswith(".pdf") and not e.name.startswith("_build_"):
+                    pdfs.append((mtime, e.path))
+        for mtime, path in sorted(pdfs, reverse=True)[PDF_CACHE_MAX_ENTRIES:]:
+            if now - mtime > PDF_IN_USE_SECONDS:
+                remove_quietly(path)
+
+@st.cache_resource(show_spinner=False)
+def sweep_build_dir_once():
+    """Startup sweep, run once per server process."""
+    sweep_build_dir()
+
+@st.cache_resource
+def get_sweep_state():
+    """Process-wide time of the last sweep, shared by all sessions."""
+    return {"last": time.time(), "lock": threading.Lock()}
+
+def maybe_sweep_build_dir():
+    """Runs sweep_build_dir if the last one was over SWEEP_INTERVAL ago; compiles call this."""
+    state = get_sweep_state()
+    with state["lock"]:
+        if time.time() - state["last"] < SWEEP_INTERVAL:
+            return
+        state["last"] = time.time()
+    sweep_build_dir()
+
+def latex_env(file_path):
+    """Lets pdflatex find files next to the source, preferring optimized images."""
+    source_dir = os.path.dirname(os.path.abspath(file_path))
+    cached_dir = os.path.join(os.path.abspath(IMAGE_CACHE_DIR), os.path.relpath(source_dir))
+    # An empty last entry (TEXINPUTS unset) keeps TeX's default search path
+    return dict(os.environ, TEXINPUTS=os.pathsep.join([cached_dir, source_dir, os.environ.get("TEXINPUTS", "")]))
+
+def run_latex(command, file_path):
+    """
+    Runs a TeX command for file_path, keeping only the last LOG_TAIL_LINES of its
+    output (logs can run to megabytes); stdout of the result holds that tail.
+    """
+    with subprocess.Popen(
+        # One pipe for both streams, drained 64 KiB per read instead of the default 8 KiB
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=65536,
+        text=True, errors="replace", env=latex_env(file_path)
+    ) as process:
+        tail = deque(process.stdout, maxlen=LOG_TAIL_LINES)
+    return subprocess.CompletedProcess(command, process.returncode, "".join(tail))
+
+PREAMBLE_END = re.compile(rb"\\begin\s*\{document\}")
+
+@st.cache_resource(show_spinner=False)
+def get_preamble_keys():
+    """Process-wide {source_path: ((mtime_ns, size), preamble key)} memo."""
+    return {}
+
+def preamble_key(file_path):
+    """xxHash64 of the text before \\begin{document}; None if the file has no such line."""
+    memo = get_preamble_keys()
+    s = os.stat(file_path)
+    version = (s.st_mtime_ns, s.st_size)
+    cached = memo.get(file_path)
+    if cached and cached[0] == version:
+        return cached[1]
+    with open(file_path, "rb") as f:
+        preamble = PREAMBLE_END.split(f.read(), maxsplit=1)
+    key = xxhash.xxh64(preamble[0]).hexdigest() if len(preamble) == 2 else None
+    memo[file_path] = (version, key)
+    return key
+
+def shared_preamble_keys(paths):
+    """
+    Keys of the PREAMBLE_FMT_MAX_ENTRIES most common preambles among paths, counting
+    only those at least two documents share: a format for a single document costs an
+    extra -ini run and never pays it back.
+    """
+    counts = Counter()
+    for path in paths:
+        try:
+            counts[preamble_key(path)] += 1
+        except OSError:
+            pass # Deleted meanwhile
+    counts.pop(None, None)
+    return {key for key, n in counts.most_common(PREAMBLE_FMT_MAX_ENTRIES) if n >= 2}
+
+@st.cache_data(show_spinner=False)
+def get_shared_preamble_keys():
+    """
+    shared_preamble_keys over every source, computed once rather than on each compile;
+    cleared when a sync or a save changes the sources.
+    """
+    return shared_preamble_keys(list_tex_files())
+
+def trim_preamble_formats():
+    """Keeps the PREAMBLE_FMT_MAX_ENTRIES most recently used preamble formats."""
+    with os.scandir(PREAMBLE_FMT_DIR) as it:
+        formats = sorted(
+            ((e.stat().st_mtime, e.path) for e in it if e.name.startswith("preamble_") and e.name.endswith(".fmt")),
+            reverse=True
+        )
+    for mtime, path in formats[PREAMBLE_FMT_MAX_ENTRIES:]:
+        remove_quietly(path)
+
+def preamble_format(file_path):
+    """
+    Returns -fmt args for a format dumped from this document's preamble (via
+    mylatexformat), building it on first use; [] if the preamble isn't shared by
+    another document or can't be dumped. Edits below \\begin{document} keep it valid.
+    """
+    key = preamble_key(file_path)
+    if key is None or key not in get_shared_preamble_keys():
+        return []
+    abs_fmt_dir = os.path.abspath(PREAMBLE_FMT_DIR)
+    os.makedirs(abs_fmt_dir, exist_ok=True)
+    fmt_name = f"preamble_{key}"
+    fmt_path = os.path.join(abs_fmt_dir, f"{fmt_name}.fmt")
+    if not os.path.exists(fmt_path):
+        job_name = f"_build_{fmt_name}_{threading.get_ident()}"
+        process = run_latex(
             [
-                "pdflatex", 
-                "-interaction=nonstopmode", 
-                f"-output-directory={abs_temp_dir}",
-                f"-jobname={job_name}",
-                file_path
+                "pdflatex", "-ini", *LATEX_FLAGS,
+                f"-output-directory={abs_fmt_dir}", f"-jobname={job_name}",
+                "&pdflatex", "mylatexformat.ltx", f'"{file_path}"'
             ],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
+            file_path
         )
-        pdf_path = os.path.join(abs_temp_dir, f"{job_name}.pdf")
-        if process.returncode == 0 and os.path.exists(pdf_path):
-            return pdf_path, None
-        else:
-            return None, process.stdout
+        build_path = os.path.join(abs_fmt_dir, f"{job_name}.fmt")
+        remove_quietly(os.path.join(abs_fmt_dir, f"{job_name}.log"))
+        if process.returncode != 0 or not os.path.exists(build_path):
+            remove_quietly(build_path)
+            return []
+        os.replace(build_path, fmt_path)
+        trim_preamble_formats()
+    else:
+        os.utime(fmt_path) # Mark as recently used for the trim
+    return [f"-fmt={fmt_path}"]
+
+def syntax_check(file_path, job_dir, fmt_args):
+    """Fast -draftmode pass (no PDF written); its .aux seeds the real pass."""
+    return run_latex(
+        [
+            "pdflatex",
+            *fmt_args,
+            *LATEX_FLAGS,
+            "-draftmode",
+            f"-output-directory={job_dir}",
+            f"-jobname={BUILD_JOB_NAME}",
+            file_path
+        ],
+        file_path
+    )
+
+def full_build(file_path, job_dir, fmt_args):
+    """The PDF-producing pass; latexmk reruns pdflatex until references settle."""
+    if LATEXMK:
+        command = [LATEXMK, "-pdf", f"-outdir={job_dir}"]
+        command += [f"-latexoption={arg}" for arg in fmt_args + LATEX_FLAGS]
+    else:
+        command = ["pdflatex", *fmt_args, *LATEX_FLAGS, f"-output-directory={job_dir}"]
+    return run_latex(
+        command + [f"-jobname={BUILD_JOB_NAME}", file_path],
+        file_path
+    )
+
+CROSS_REFERENCES = re.compile(rb"\\(?:ref|eqref|pageref|autoref|cref|Cref|nameref|cite|tableofcontents|listoffigures|listoftables)\b")
+
+# Log lines that blame the preloaded format rather than the document itself
+FORMAT_FAILURES = re.compile(r"Option clash|can be loaded only once|Fatal format file error|was written by|made by different executable")
+
+def needs_two_passes(file_path):
+    """True if the source uses anything that is only resolved from a previous pass's .aux."""
+    with open(file_path, "rb") as f:
+        return CROSS_REFERENCES.search(f.read()) is not None
+
+@st.cache_resource
+def get_compile_executor():
+    """Process-wide worker pool, so pdflatex never blocks a session's script thread."""
+    return ThreadPoolExecutor(max_workers=2)
+
+@st.cache_resource
+def get_compile_locks():
+    """One lock per source path, shared by all sessions."""
+    return defaultdict(threading.Lock)
+
+@st.cache_resource
+def get_prefetch_state():
+    """Single-worker pool for speculative compiles, kept apart so they never delay a
+    requested one, and the set of paths queued on it."""
+    return ThreadPoolExecutor(max_workers=1), set()
+
+def prefetch_neighbours(files, selected_file, folder):
+    """Compiles the .tex files either side of the selection in the background, so
+    stepping through a folder finds them in the PDF cache."""
+    pool, pending = get_prefetch_state()
+    i = files.index(selected_file)
+    for name in files[max(i - 1, 0):i] + files[i + 1:i + 2]:
+        path = absolute_path(os.path.join(folder, name))
+        if name.lower().endswith(".tex") and path not in pending:
+            pending.add(path)
+            pool.submit(compile_latex, path).add_done_callback(lambda _, path=path: pending.discard(path))
+
+# pdflatex runs once per document on purpose: a run writes exactly one PDF, LaTeX state
+# can't be reset between documents, and an idle pre-started pdflatex only loads its format
+# after reading its first input line. Startup is trimmed with spo.fmt instead.
+def compile_latex(file_path):
+    """(pdf, None) on success, else (None, log)."""
+    abs_temp_dir = os.path.abspath(TEMP_DIR)
+    
+    try:
+        # A second compile of the same file waits here, then hits the first one's PDF
+        with get_compile_locks()[file_path]:
+            # Identical sources share one PDF, so a hit skips pdflatex entirely
+            key = get_source_key(file_path)
+            pdf_path = os.path.join(abs_temp_dir, f"{key}.pdf")
+            if os.path.exists(pdf_path):
+                os.utime(pdf_path) # Mark as recently used for the sweep
+                return pdf_path, None
+
+            optimize_folder_images(os.path.dirname(file_path))
+            # One build folder per source path: no two documents share aux files, and
+            # the next compile of this one starts from its previous .aux
+            job_dir = os.path.join(abs_temp_dir, f"job_{xxhash.xxh64(file_path.encode('utf-8')).hexdigest()}")
+            os.makedirs(job_dir, exist_ok=True)
+            # Prefer a dump of this document's own preamble, then the shared spo.fmt
+            fmt_args = preamble_format(file_path) or FMT_ARGS
+            # Cross-references need an .aux first: a cheap -draftmode pass writes it and
+            # surfaces errors before the real pass. Other documents go straight to the PDF.
+            two_pass = needs_two_passes(file_path)
+            first_pass = syntax_check if two_pass else full_build
+            process = first_pass(file_path, job_dir, fmt_args)
+            if process.returncode != 0 and fmt_args and FORMAT_FAILURES.search(process.stdout):
+                # The preamble clashed with the preloaded packages; retry on the stock format.
+                # Any other error would only fail again, so it is reported straight away.
+                fmt_args = []
+                process = first_pass(file_path, job_dir, fmt_args)
+            if process.returncode != 0:
+                return None, process.stdout
+            if two_pass:
+                process = full_build(file_path, job_dir, fmt_args)
+            build_path = os.path.join(job_dir, f"{BUILD_JOB_NAME}.pdf")
+            if process.returncode == 0 and os.path.exists(build_path):
+                os.replace(build_path, pdf_path)
+                maybe_sweep_build_dir()
+                return pdf_path, None
+            else:
+                return None, process.stdout
     except Exception as e:
         return None, str(e)
 
+def compile_many(paths):
+    """
+    Compiles several documents at once, one pdflatex per core; returns (path, pdf, log)
+    tuples. Each document builds in its own folder, so parallel runs never share aux files.
+    """
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        return [(path, *result) for path, result in zip(paths, pool.map(compile_latex, paths))]
+
+def list_tex_files():
+    """Absolute paths of every .tex source in BASE_DIRS."""
+    paths = []
+    for folder_name in BASE_DIRS.values():
+        for root, _, files in os.walk(folder_name):
+            paths += [os.path.abspath(os.path.join(root, f)) for f in files if f.lower().endswith(".tex")]
+    return paths
+
+def warm_preamble_formats(paths):
+    """
+    Builds the formats of the preambles shared among paths (at most
+    PREAMBLE_FMT_MAX_ENTRIES), one document each, as a single job on the prefetch pool:
+    requested compiles never queue behind it.
+    """
+    shared = shared_preamble_keys(paths)
+    representatives = {}
+    for path in paths:
+        key = preamble_key(path)
+        if key in shared:
+            representatives.setdefault(key, path)
+    def warm():
+        for path in representatives.values():
+            try:
+                preamble_format(path)
+            except OSError:
+                pass # Deleted meanwhile; its next compile sorts itself out
+    pool, _ = get_prefetch_state()
+    pool.submit(warm)
+
+def publish_pdf(pdf_path):
+    """
+    Exposes a compiled PDF through Streamlit's static file serving and returns its URL,
+    so the viewer iframe loads it directly instead of through the Python process.
+    The file is named after a random token kept in this session's state (never after
+    the document), and each new PDF replaces the session's previous one.
+    """
+    if "pdf_token" not in st.session_state:
+        st.session_state.pdf_token = secrets.token_urlsafe(16)
+    static_path = os.path.join(STATIC_PDF_DIR, f"{st.session_state.pdf_token}.pdf")
+    tmp_path = f"{static_path}.tmp"
+    remove_quietly(tmp_path) # Left over from an interrupted publish
+    try:
+        os.link(pdf_path, tmp_path)
+    except OSError:
+        shutil.copyfile(pdf_path, tmp_path) # TEMP_DIR may be on another filesystem (tmpfs)
+    os.replace(tmp_path, static_path)
+    # The query string only changes the URL per version, so the iframe reloads
+    return f"app/static/pdfs/{st.session_state.pdf_token}.pdf?v={os.path.basename(pdf_path)[:-4]}"
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def read_pdf_bytes(pdf_path, mtime):
+    """Maps the PDF once per version; reruns reuse the cached bytes."""
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return bytes(mm)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def read_text(path, mtime_ns, size):
+    """Reads a source file once per version (mtime_ns and size are part of the cache key)."""
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "" # mmap can't map an empty file
+        # Decoded straight from the mapping: the raw bytes are never copied into Python
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, "utf-8")
+    # The newline translation text-mode open() would have done
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+HIGHLIGHT_MAX_BYTES = 200 * 1024 # Larger sources are shown as plain text
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def highlight_tex(path, mtime_ns, size):
+    """Syntax-highlighted HTML for a source file, built once per version."""
+    text = read_text(path, mtime_ns, size)
+    if len(text.encode("utf-8")) > HIGHLIGHT_MAX_BYTES:
+        return f"<pre>{html.escape(text)}</pre>"
+    return highlight(text, TexLexer(), HtmlFormatter(noclasses=True))
+
+@functools.lru_cache(maxsize=256)
+def absolute_path(rel_path):
+    """abspath of a selected file, resolved once per path (the cwd never changes)."""
+    return os.path.abspath(rel_path)
+
+def cached_pdf(key):
+    """The compiled PDF for a source key if it is already in TEMP_DIR, else None."""
+    pdf_path = os.path.join(os.path.abspath(TEMP_DIR), f"{key}.pdf")
+    try:
+        os.utime(pdf_path) # Mark as recently used for the sweep
+    except FileNotFoundError:
+        return None
+    return pdf_path
+
+def show_compiled(pdf, log):
+    """Puts a compile result into session state and publishes the PDF."""
+    st.session_state.current_pdf = pdf
+    st.session_state.current_pdf_mtime = os.path.getmtime(pdf) if pdf else None
+    st.session_state.compilation_error = log
+    st.session_state.current_pdf_url = publish_pdf(pdf) if pdf else None
+
+def download_pdf(file_path, pdf_path, mtime):
+    """
+    Bytes for the download button, fetched on click. If the sweep has removed the PDF
+    since it was shown, the source is compiled again rather than failing the download.
+    """
+    try:
+        return read_pdf_bytes(pdf_path, mtime)
+    except FileNotFoundError:
+        pdf_path, log = compile_latex(file_path)
+        if pdf_path is None:
+            raise RuntimeError(f"{file_path} no longer compiles") from None
+        return read_pdf_bytes(pdf_path, os.path.getmtime(pdf_path))
+
+def read_current_pdf():
+    """Cached bytes of this session's PDF, or None if it has been swept away since."""
+    try:
+        return read_pdf_bytes(st.session_state.current_pdf, st.session_state.current_pdf_mtime)
+    except FileNotFoundError:
+        return None
+
+# --- BUILD CACHE SWEEP ---
+# Trim stale PDFs left over from earlier runs (once per process)
+sweep_build_dir_once()
+
 # ==========================================
 # 🖥️ SIDEBAR NAVIGATION
 # ==========================================
@@ -216,11 +900,20 @@ if current_role == 'admin':
         with st.spinner("Syncing Topics and Year..."):
             success, msg = pull_from_github()
             if success:
+                warm_preamble_formats(list_tex_files())
                 st.sidebar.success(msg)
                 st.rerun()
             else:
                 st.sidebar.error(msg)
 
+    if st.sidebar.button("🛠️ Rebuild All"):
+        with st.spinner("Compiling all documents..."):
+            failed = [path for path, pdf, log in compile_many(list_tex_files()) if pdf is None]
+        if failed:
+            st.sidebar.warning(f"{len(failed)} document(s) failed: " + ", ".join(os.path.basename(p) for p in failed))
+        else:
+            st.sidebar.success("All documents compiled.")
+
 if st.sidebar.button("Logout", type="secondary"):
     st.session_state.user_role = None
     st.rerun()
@@ -230,7 +923,7 @@ browse_mode = st.sidebar.radio("Library Section:", ["Topics", "Year"], horizonta
 current_root_dir = BASE_DIRS[browse_mode] 
 
 # 2. SELECT SUBFOLDER
-subfolders = get_subfolders(current_root_dir)
+subfolders = get_subfolders(current_root_dir, dir_mtime(current_root_dir))
 
 if not subfolders:
     st.sidebar.error(f"No folders found in '{current_root_dir}'.")
@@ -239,7 +932,10 @@ if not subfolders:
 selected_subfolder = st.sidebar.selectbox(f"Select {browse_mode[:-1]}", subfolders)
 
 # 3. SELECT FILE
-files = get_files(current_root_dir, selected_subfolder)
+files = get_files(
+    current_root_dir, selected_subfolder,
+    dir_mtime(os.path.join(current_root_dir, selected_subfolder))
+)
 
 if not files:
     st.sidebar.warning("No files found.")
@@ -249,7 +945,7 @@ selected_file = st.sidebar.radio(f"Documents in {selected_subfolder}", files)
 
 # Build Paths
 rel_path = os.path.join(current_root_dir, selected_subfolder, selected_file).replace("\\", "/")
-abs_path = os.path.abspath(rel_path)
+abs_path = absolute_path(rel_path)
 
 # ==========================================
 # 👁️ MAIN VIEW / EDIT LOGIC
@@ -264,22 +960,43 @@ is_tex = file_ext == 'tex'
 # Check if we need to recompile or if selection changed
 if "force_recompile" not in st.session_state: st.session_state.force_recompile = False
 if "last_processed" not in st.session_state: st.session_state.last_processed = None
+if "compile_job" not in st.session_state: st.session_state.compile_job = None
 
-if st.session_state.last_processed != rel_path or st.session_state.force_recompile:
+# Selections are (path, content key): a .tex changed by a sync or push recompiles in place
+selection = (rel_path, get_source_key(abs_path) if is_tex else None)
+if st.session_state.last_processed != selection or st.session_state.force_recompile:
     st.session_state.current_pdf = None
+    st.session_state.current_pdf_mtime = None
     st.session_state.compilation_error = None
+    st.session_state.current_pdf_url = None
+    st.session_state.compile_job = None
     
     if is_pdf:
         st.session_state.current_pdf = abs_path
+        st.session_state.current_pdf_mtime = os.path.getmtime(abs_path)
+    elif is_tex and (pdf := cached_pdf(selection[1])):
+        # Already built: shown in this run, with no job to poll
+        show_compiled(pdf, None)
+        prefetch_neighbours(files, selected_file, os.path.dirname(rel_path))
     elif is_tex:
-        with st.spinner(f"Compiling {selected_file}..."):
-            pdf, log = compile_latex(abs_path)
-            st.session_state.current_pdf = pdf
-            st.session_state.compilation_error = log
+        # Compile in the background; a job for a previous selection is simply dropped
+        st.session_state.compile_job = get_compile_executor().submit(compile_latex, abs_path)
             
-    st.session_state.last_processed = rel_path
+    st.session_state.last_processed = selection
     st.session_state.force_recompile = False
 
+# Poll the background compile; the sidebar stays usable while it runs
+if st.session_state.compile_job is not None:
+    if st.session_state.compile_job.done():
+        show_compiled(*st.session_state.compile_job.result())
+        st.session_state.compile_job = None
+        # The reader is likely to move on to a neighbour next; build those while they read
+        prefetch_neighbours(files, selected_file, os.path.dirname(rel_path))
+    else:
+        st.status(f"Compiling {selected_file}...", state="running", expanded=False)
+        time.sleep(0.3)
+        st.rerun()
+
 # TABS
 tab_label = "✏️ Edit Source" if current_role == 'admin' else "📝 Source Code"
 tab_view, tab_edit = st.tabs(["📄 Document Viewer", tab_label])
@@ -289,14 +1006,26 @@ with tab_view:
     if is_image:
         st.success(f"**{selected_file}** loaded.")
         st.image(abs_path, caption=selected_file, use_container_width=True)
-    elif st.session_state.current_pdf and os.path.exists(st.session_state.current_pdf):
+    elif st.session_state.current_pdf_url:
         col1, col2 = st.columns([6, 1])
         with col1: st.success(f"**{selected_file}** loaded.")
-        with col2:
-            with open(st.session_state.current_pdf, "rb") as f:
-                st.download_button("⬇️ PDF", f, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
+        # A named download rather than a link to the token-named static file; the bytes
+        # are only read when the button is clicked
+        with col2: st.download_button(
+            "⬇️ PDF", functools.partial(download_pdf, abs_path, st.session_state.current_pdf, st.session_state.current_pdf_mtime),
+            file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary", on_click="ignore"
+        )
         st.markdown("---")
-        pdf_viewer(st.session_state.current_pdf, width=800, height=1000)
+        # The browser loads (and caches) the published PDF itself, so reruns don't
+        # resend the document through the websocket
+        components.iframe(st.session_state.current_pdf_url, width=820, height=1000)
+    elif st.session_state.current_pdf and (pdf_bytes := read_current_pdf()) is not None:
+        col1, col2 = st.columns([6, 1])
+        with col1: st.success(f"**{selected_file}** loaded.")
+        with col2: st.download_button("⬇️ PDF", pdf_bytes, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
+        st.markdown("---")
+        from streamlit_pdf_viewer import pdf_viewer # Only this branch needs the component
+        pdf_viewer(pdf_bytes, width=800, height=1000)
     elif st.session_state.compilation_error:
         st.error("⚠️ Compilation Failed")
         with st.expander("Error Log"):
@@ -308,8 +1037,9 @@ with tab_edit:
         st.info(f"Binary file ({file_ext.upper()}) cannot be edited directly.")
     else:
         # Read file
-        with open(abs_path, "r", encoding="utf-8") as f:
-            file_content = f.read()
+        source_stat = os.stat(abs_path)
+        source_version = (source_stat.st_mtime_ns, source_stat.st_size)
+        file_content = read_text(abs_path, *source_version)
 
         if current_role == 'admin':
             st.warning(f"⚠️ You are editing: {rel_path}")
@@ -323,9 +1053,6 @@ with tab_edit:
             
             if st.button("💾 Push to GitHub", type="primary"):
                 if new_content != file_content:
-                    with open(abs_path, "w", encoding="utf-8") as f:
-                        f.write(new_content)
-                    
                     with st.spinner("Pushing to GitHub..."):
                         success, msg = push_to_github(
                             rel_path, 
@@ -333,7 +1060,13 @@ with tab_edit:
                             f"Update {selected_file} via Streamlit"
                         )
                     if success:
+                        # Written only once GitHub has it: a failed push leaves the file
+                        # as the next Pull expects it, and the edit stays in the text area
+                        with open(abs_path, "w", encoding="utf-8") as f:
+                            f.write(new_content)
                         st.success(msg)
+                        read_text.clear() # Drop the pre-edit text
+                        get_shared_preamble_keys.clear() # The edit may have changed the preamble
                         st.session_state.force_recompile = True
                         st.rerun()
                     else:
@@ -342,4 +1075,5 @@ with tab_edit:
                     st.info("No changes detected.")
         else:
             st.caption(f"Path: {rel_path}")
-            st.code(file_content, language="latex")
+            with st.expander("Show source", expanded=False):
+                st.html(highlight_tex(abs_path, *source_version))
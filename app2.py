@@ -1,7 +1,14 @@
 import streamlit as st
 import os
+import mmap
 import subprocess
+import tempfile
+import hashlib
+import html
 from streamlit_pdf_viewer import pdf_viewer
+from pygments import highlight
+from pygments.lexers import TexLexer
+from pygments.formatters import HtmlFormatter
 
 # --- Configuration ---
 TOPICS_DIR = "topics"
@@ -54,39 +61,86 @@ if not check_login():
 # ==========================================
 
 # --- Helper Functions ---
+@st.cache_data(ttl=60)
 def get_topics():
     if not os.path.exists(TOPICS_DIR): return []
-    return sorted([d for d in os.listdir(TOPICS_DIR) if os.path.isdir(os.path.join(TOPICS_DIR, d))])
+    with os.scandir(TOPICS_DIR) as it:
+        return sorted(e.name for e in it if e.is_dir())
 
+@st.cache_data(ttl=60)
 def get_tex_files(topic):
     topic_path = os.path.join(TOPICS_DIR, topic)
-    return sorted([f for f in os.listdir(topic_path) if f.endswith(".tex")])
+    with os.scandir(topic_path) as it:
+        return sorted(e.name for e in it if e.is_file() and e.name.endswith(".tex"))
 
 def compile_latex(file_path):
     file_name = os.path.basename(file_path)
-    job_name = os.path.splitext(file_name)[0]
+    # Unique per source: cached results outlive the session, so same-named
+    # files in different topics must not overwrite each other's PDF
+    path_tag = hashlib.md5(file_path.encode("utf-8")).hexdigest()[:8]
+    job_name = f"{os.path.splitext(file_name)[0]}_{path_tag}"
     
     try:
-        process = subprocess.run(
-            [
-                "pdflatex", 
-                "-interaction=nonstopmode", 
-                f"-output-directory={TEMP_DIR}",
-                f"-jobname={job_name}",
-                file_path
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        pdf_path = os.path.join(TEMP_DIR, f"{job_name}.pdf")
-        if process.returncode == 0 and os.path.exists(pdf_path):
-            return pdf_path, None
-        else:
-            return None, process.stdout
+        # The log goes to a temp file and is only decoded if the compile fails
+        with tempfile.TemporaryFile() as log_file:
+            process = subprocess.run(
+                [
+                    "pdflatex", 
+                    "-interaction=nonstopmode",
+                    "-halt-on-error",
+                    "-no-shell-escape",
+                    "-file-line-error",
+                    f"-output-directory={TEMP_DIR}",
+                    f"-jobname={job_name}",
+                    file_path
+                ],
+                stdout=log_file, stderr=subprocess.STDOUT
+            )
+            pdf_path = os.path.join(TEMP_DIR, f"{job_name}.pdf")
+            if process.returncode == 0 and os.path.exists(pdf_path):
+                return pdf_path, None
+            else:
+                log_file.seek(0)
+                return None, log_file.read().decode("utf-8", "replace")
     except Exception as e:
         return None, str(e)
 
+@st.cache_data(show_spinner=False, max_entries=128, ttl=24*3600)
+def _compile_cached(source_path, mtime_ns, size):
+    """Memoizes compile_latex across reruns and sessions until the file changes.
+
+    Returns the PDF bytes rather than the build path, so a cached entry stays
+    valid even if temp_build is cleaned out underneath it.
+    """
+    pdf_path, error_log = compile_latex(source_path)
+    if pdf_path is None:
+        return None, error_log
+    with open(pdf_path, "rb") as f:
+        return f.read(), None
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def read_text(path, mtime_ns):
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "" # mmap can't map an empty file
+        # Decoded straight from the mapping: the raw bytes are never copied into Python
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, "utf-8")
+    # The newline translation text-mode open() would have done
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+HIGHLIGHT_MAX_BYTES = 200 * 1024 # Larger sources are shown as plain text
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def highlight_tex(path, mtime_ns):
+    """Syntax-highlighted HTML for a source file, built once per version."""
+    text = read_text(path, mtime_ns)
+    if len(text.encode("utf-8")) > HIGHLIGHT_MAX_BYTES:
+        return f"<pre>{html.escape(text)}</pre>"
+    return highlight(text, TexLexer(), HtmlFormatter(noclasses=True))
+
 # --- Sidebar Navigation ---
 st.sidebar.title("Physics Archive")
 
@@ -116,51 +170,39 @@ selected_file = st.sidebar.radio(f"Documents in {selected_topic}", tex_files)
 # --- Auto-Compilation & Logic ---
 source_path = os.path.join(TOPICS_DIR, selected_topic, selected_file)
 
-if "last_compiled_file" not in st.session_state:
-    st.session_state.last_compiled_file = None
-if "compilation_error" not in st.session_state:
-    st.session_state.compilation_error = None
-
-if st.session_state.last_compiled_file != source_path:
-    with st.spinner(f"Rendering {selected_file}..."):
-        pdf_path, error_log = compile_latex(source_path)
-        
-        if pdf_path:
-            st.session_state.current_pdf_path = pdf_path
-            st.session_state.last_compiled_file = source_path
-            st.session_state.compilation_error = None
-        else:
-            st.session_state.current_pdf_path = None
-            st.session_state.compilation_error = error_log
+with st.spinner(f"Rendering {selected_file}..."):
+    source_stat = os.stat(source_path)
+    pdf_bytes, error_log = _compile_cached(
+        source_path, source_stat.st_mtime_ns, source_stat.st_size
+    )
 
 # --- Main View ---
 tab_view, tab_code = st.tabs(["📄 Document Viewer", "📝 Source Code"])
 
 with tab_view:
-    if st.session_state.get("current_pdf_path") and os.path.exists(st.session_state.current_pdf_path):
+    if pdf_bytes:
         
         col1, col2 = st.columns([6, 1])
         with col1:
             st.success(f"**{selected_file}** rendered successfully.")
         with col2:
-            with open(st.session_state.current_pdf_path, "rb") as f:
-                st.download_button(
-                    label="⬇️ Download PDF",
-                    data=f,
-                    file_name=selected_file.replace('.tex', '.pdf'),
-                    mime="application/pdf",
-                    type="primary"
-                )
+            st.download_button(
+                label="⬇️ Download PDF",
+                data=pdf_bytes,
+                file_name=selected_file.replace('.tex', '.pdf'),
+                mime="application/pdf",
+                type="primary"
+            )
         
         st.markdown("---")
-        pdf_viewer(st.session_state.current_pdf_path, width=800, height=1000)
+        pdf_viewer(pdf_bytes, width=800, height=1000)
 
-    elif st.session_state.get("compilation_error"):
+    elif error_log:
         st.error("⚠️ Compilation Failed")
         with st.expander("View Error Log", expanded=True):
-            st.code(st.session_state.compilation_error, language="text")
+            st.code(error_log, language="text")
 
 with tab_code:
     st.caption(f"File: {source_path}")
-    with open(source_path, "r", encoding="utf-8") as f:
-        st.code(f.read(), language="latex")
+    with st.expander("Show source", expanded=False):
+        st.html(highlight_tex(source_path, source_stat.st_mtime_ns))
@@ -1,8 +1,14 @@
 import streamlit as st
 import os
+import mmap
 import subprocess
+import tempfile
 from streamlit_pdf_viewer import pdf_viewer
 import shutil
+import contextlib
+import hashlib
+import requests
+import tarfile
 # NEW
 from github import Github, Auth
 
@@ -11,6 +17,10 @@ TOPICS_DIR = "topics"
 TEMP_DIR = "temp_build"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+PDF_CACHE_MAX_ENTRIES = 200   # Most recently used compiled PDFs kept in TEMP_DIR
+# Up to this many changed files are fetched one by one; more than that, as one tarball
+BLOB_FETCH_LIMIT = 20
+
 st.set_page_config(page_title="Physics Topics", layout="wide")
 
 # ==========================================
@@ -84,48 +94,101 @@ def push_to_github(local_path, content, commit_message):
     except Exception as e:
         return False, f"GitHub Error: {str(e)}"
 
+def dir_is_empty(path):
+    """True if path has no entries; stops at the first one instead of listing them all."""
+    with os.scandir(path) as it:
+        return next(it, None) is None
+
+def git_blob_sha(path):
+    """Git's object id for a local file: sha1 over 'blob <size>\\0' + content."""
+    with open(path, "rb") as f:
+        data = f.read()
+    return hashlib.sha1(f"blob {len(data)}\0".encode() + data).hexdigest()
+
 def pull_from_github():
     """
-    1. Wipes the local 'topics' folder.
-    2. Downloads a fresh copy from GitHub.
+    Syncs the local 'topics' folder with GitHub:
+    1. Lists every remote file with its blob sha (one request).
+    2. Deletes local files that are gone from GitHub.
+    3. Downloads only files that are new or whose content changed.
     """
     try:
-        # 1. WIPE LOCAL FOLDER CLEAN
-        if os.path.exists(TOPICS_DIR):
-            shutil.rmtree(TOPICS_DIR)  # Deletes the folder and everything inside
-        
-        # Re-create the empty folder
-        os.makedirs(TOPICS_DIR, exist_ok=True)
-
-        # 2. CONNECT TO GITHUB
+        # 1. CONNECT TO GITHUB
         # --- FIX STARTS HERE ---
         auth_token = Auth.Token(st.secrets["github_token"])
         g = Github(auth=auth_token)
         # --- FIX ENDS HERE ---
         
         repo = g.get_repo(st.secrets["github_repo"])
+        head_sha = repo.get_branch(st.secrets["github_branch"]).commit.sha
+        tree = repo.get_git_tree(head_sha, recursive=True)
+        remote = {e.path: e.sha for e in tree.tree if e.type == "blob" and e.path.startswith(TOPICS_DIR + "/")}
         
-        # 3. DOWNLOAD EVERYTHING
-        contents = repo.get_contents(TOPICS_DIR, ref=st.secrets["github_branch"])
-        count = 0
+        # 2. REMOVE FILES (AND EMPTIED FOLDERS) DELETED ON GITHUB
+        os.makedirs(TOPICS_DIR, exist_ok=True)
+        local_paths = set()
+        for root, dirs, files in os.walk(TOPICS_DIR, topdown=False):
+            for f in files:
+                local_path = os.path.join(root, f).replace("\\", "/")
+                if local_path in remote:
+                    local_paths.add(local_path)
+                else:
+                    os.remove(local_path)
+            if root != TOPICS_DIR and dir_is_empty(root):
+                os.rmdir(root)
         
-        while contents:
-            file_content = contents.pop(0)
-            if file_content.type == "dir":
-                contents.extend(repo.get_contents(file_content.path, ref=st.secrets["github_branch"]))
-            else:
-                # Calculate where to save it locally
-                local_path = file_content.path 
-                
-                # Ensure the subfolder exists
-                os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                
-                # Write the file
-                with open(local_path, "wb") as f:
-                    f.write(file_content.decoded_content)
-                count += 1
+        # 3. DOWNLOAD WHAT CHANGED
+        # Blob shas are content hashes, so an equal sha means an identical file
+        changed = {p for p, sha in remote.items() if p not in local_paths or git_blob_sha(p) != sha}
+        
+        saved = []
+        def save(local_path, source):
+            # Written to a .part file that replaces the old one at the end, so an
+            # interrupted sync never leaves a truncated file behind
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            part_path = f"{local_path}.part"
+            try:
+                with open(part_path, "wb") as f:
+                    shutil.copyfileobj(source, f)
+            except BaseException:
+                with contextlib.suppress(FileNotFoundError): # open() itself may have failed
+                    os.remove(part_path)
+                raise
+            os.replace(part_path, local_path)
+            saved.append(local_path)
+        
+        if len(changed) > BLOB_FETCH_LIMIT:
+            # Many changes (e.g. first sync): one gzip'd tarball stream beats a request per file
+            url = repo.get_archive_link("tarball", ref=head_sha)
+            with requests.get(url, stream=True, timeout=120) as response:
+                response.raise_for_status()
+                with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                    for member in archive:
+                        # Members are named "<owner>-<repo>-<sha>/<path>"
+                        local_path = member.name.split("/", 1)[-1]
+                        if member.isfile() and local_path in changed:
+                            save(local_path, archive.extractfile(member))
+        else:
+            # A few changes: one raw blob request each (no base64 to decode)
+            with requests.Session() as session:
+                session.headers.update({"Authorization": f"Bearer {st.secrets['github_token']}", "Accept": "application/vnd.github.raw"})
+                for local_path in changed:
+                    url = f"https://api.github.com/repos/{repo.full_name}/git/blobs/{remote[local_path]}"
+                    with session.get(url, stream=True, timeout=60) as response:
+                        response.raise_for_status()
+                        response.raw.decode_content = True # Undo any gzip transfer encoding
+                        save(local_path, response.raw)
                     
-        return True, f"Clean sync complete! Downloaded {count} files."
+        # The cached directory listings are stale now
+        get_topics.clear()
+        get_topic_files.clear()
+        unchanged = len(remote) - len(changed)
+        msg = f"Sync complete! Downloaded {len(saved)} files ({unchanged} already up to date)."
+        # e.g. files the tarball didn't contain; they still differ, so the next sync retries them
+        missing = sorted(changed.difference(saved))
+        if missing:
+            msg += f" {len(missing)} files were not downloaded and will be retried on the next sync: {', '.join(missing)}"
+        return True, msg
     except Exception as e:
         return False, str(e)
 
@@ -133,45 +196,84 @@ def pull_from_github():
 # 🚀 MAIN APP LOGIC
 # ==========================================
 
+@st.cache_data(ttl=60)
 def get_topics():
     if not os.path.exists(TOPICS_DIR): return []
-    return sorted([d for d in os.listdir(TOPICS_DIR) if os.path.isdir(os.path.join(TOPICS_DIR, d))])
+    with os.scandir(TOPICS_DIR) as it:
+        return sorted(e.name for e in it if e.is_dir())
 
+@st.cache_data(ttl=60)
 def get_topic_files(topic):
     topic_path = os.path.join(TOPICS_DIR, topic)
     # MODIFIED: Now accepts images (jpg, png) in addition to tex and pdf
     allowed_extensions = ('.tex', '.pdf', '.jpg', '.jpeg', '.png')
-    return sorted([f for f in os.listdir(topic_path) if f.lower().endswith(allowed_extensions)])
+    with os.scandir(topic_path) as it:
+        return sorted(e.name for e in it if e.is_file() and e.name.lower().endswith(allowed_extensions))
+
+def source_hash(file_path):
+    """Content key of a .tex file; identical sources share one compiled PDF."""
+    with open(file_path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+@st.cache_resource(show_spinner=False)
+def sweep_pdf_cache():
+    """Startup sweep: keeps only the PDF_CACHE_MAX_ENTRIES most recently used PDFs."""
+    with os.scandir(TEMP_DIR) as it:
+        pdfs = sorted((e.stat().st_mtime, e.path) for e in it if e.is_file() and e.name.endswith(".pdf"))
+    for mtime, path in pdfs[:max(0, len(pdfs) - PDF_CACHE_MAX_ENTRIES)]:
+        os.unlink(path)
 
 def compile_latex(file_path):
-    file_name = os.path.basename(file_path)
-    job_name = os.path.splitext(file_name)[0]
-    
     abs_temp_dir = os.path.abspath(TEMP_DIR)
     
     try:
-        process = subprocess.run(
-            [
-                "pdflatex", 
-                "-interaction=nonstopmode", 
-                f"-output-directory={abs_temp_dir}",
-                f"-jobname={job_name}",
-                file_path
-            ],
-            stdout=subprocess.PIPE,
-            stderr=subprocess.PIPE,
-            text=True
-        )
-        pdf_path = os.path.join(abs_temp_dir, f"{job_name}.pdf")
-        
-        if process.returncode == 0 and os.path.exists(pdf_path):
+        # A PDF built from byte-identical source is reused without running pdflatex
+        key = source_hash(file_path)
+        pdf_path = os.path.join(abs_temp_dir, f"{key}.pdf")
+        if os.path.exists(pdf_path):
+            os.utime(pdf_path) # Mark as recently used for the sweep
             return pdf_path, None
-        else:
-            return None, process.stdout
+        
+        job_name = f"_build_{key}"
+        # The log goes to a temp file and is only decoded if the compile fails
+        with tempfile.TemporaryFile() as log_file:
+            process = subprocess.run(
+                [
+                    "pdflatex", 
+                    "-interaction=nonstopmode",
+                    "-halt-on-error",
+                    "-no-shell-escape",
+                    "-file-line-error",
+                    f"-output-directory={abs_temp_dir}",
+                    f"-jobname={job_name}",
+                    file_path
+                ],
+                stdout=log_file, stderr=subprocess.STDOUT
+            )
+            build_path = os.path.join(abs_temp_dir, f"{job_name}.pdf")
+            if process.returncode == 0 and os.path.exists(build_path):
+                os.replace(build_path, pdf_path)
+                return pdf_path, None
+            else:
+                log_file.seek(0)
+                return None, log_file.read().decode("utf-8", "replace")
     except Exception as e:
         return None, str(e)
 
-        
+@st.cache_data(max_entries=16, show_spinner=False)
+def read_pdf_bytes(pdf_path, mtime):
+    """Maps the PDF once per version; reruns reuse the cached bytes."""
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return bytes(mm)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def read_text(path, mtime_ns, size):
+    """Reads a source file once per version (mtime_ns and size are part of the cache key)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+sweep_pdf_cache()
+
 # --- SIDEBAR ---
 st.sidebar.title(f"Physics Archive ({current_role.title()})")
 
@@ -221,8 +323,11 @@ is_image = file_ext in ['jpg', 'jpeg', 'png']
 is_pdf = file_ext == 'pdf'
 is_tex = file_ext == 'tex'
 
-# Run processing only if file changed or recompile forced
-if st.session_state.last_processed != rel_path or st.session_state.force_recompile:
+# Run processing only if the selection or its file changed on disk (inode, mtime, size:
+# one stat, no read), or recompile forced; unchanged content is a cache hit in compile_latex
+selection_stat = os.stat(abs_path)
+selection = (rel_path, selection_stat.st_ino, selection_stat.st_mtime_ns, selection_stat.st_size)
+if st.session_state.last_processed != selection or st.session_state.force_recompile:
     
     st.session_state.current_pdf = None
     st.session_state.compilation_error = None
@@ -238,7 +343,7 @@ if st.session_state.last_processed != rel_path or st.session_state.force_recompi
             
     # For images, we don't need to "process" them, we just read them directly in the view
             
-    st.session_state.last_processed = rel_path
+    st.session_state.last_processed = selection
     st.session_state.force_recompile = False
 
 # --- TABS ---
@@ -254,14 +359,15 @@ with tab_view:
         
     # B. PDF VIEWER (Native or Compiled)
     elif st.session_state.current_pdf and os.path.exists(st.session_state.current_pdf):
+        # One cached read feeds both the download button and the viewer
+        pdf_bytes = read_pdf_bytes(st.session_state.current_pdf, os.path.getmtime(st.session_state.current_pdf))
         col1, col2 = st.columns([6, 1])
         with col1: st.success(f"**{selected_file}** loaded.")
         with col2:
-            with open(st.session_state.current_pdf, "rb") as f:
-                st.download_button("⬇️ PDF", f, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
+            st.download_button("⬇️ PDF", pdf_bytes, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
         
         st.markdown("---")
-        pdf_viewer(st.session_state.current_pdf, width=800, height=1000)
+        pdf_viewer(pdf_bytes, width=800, height=1000)
         
     # C. ERROR STATE
     elif st.session_state.compilation_error:
@@ -275,8 +381,8 @@ with tab_edit:
         st.info(f"Binary file ({file_ext.upper()}) cannot be edited directly.")
     else:
         # Read current content
-        with open(abs_path, "r", encoding="utf-8") as f:
-            file_content = f.read()
+        source_stat = os.stat(abs_path)
+        file_content = read_text(abs_path, source_stat.st_mtime_ns, source_stat.st_size)
 
         if current_role == 'admin':
             st.warning(f"⚠️ You are editing: {selected_file}")
@@ -306,6 +412,7 @@ with tab_edit:
                     
                     if success:
                         st.success(msg)
+                        read_text.clear()
                         st.session_state.force_recompile = True
                         st.rerun()
                     else:
@@ -1,10 +1,21 @@
 import streamlit as st
 import os
+import mmap
 import subprocess
+import tempfile
 from streamlit_pdf_viewer import pdf_viewer
-from github import Github, Auth
-import shutil
-from cryptography.fernet import Fernet
+from github import Github, Auth, GithubRetry
+from cryptography.fernet import Fernet, InvalidToken
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives import hashes
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+import requests
+import tarfile
+import base64
+import json
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
 
 # --- Configuration ---
 # We now define a list of folders to manage
@@ -16,13 +27,29 @@ BASE_DIRS = {
 TEMP_DIR = "temp_build"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+PDF_CACHE_MAX_ENTRIES = 200   # Most recently used compiled PDFs kept in TEMP_DIR
+
+# Marks content encrypted with AES-GCM; anything else is a Fernet token
+GCM_HEADER = b"GCM1"
+# How every Fernet token starts: base64 of its version byte and a timestamp's zero high bytes
+FERNET_PREFIX = b"gAAAAA"
+
+# Blob sha of every synced file, as of the last pull
+SYNC_STATE_FILE = ".sync_state.json"
+# Above this many changed files, one tarball download replaces per-file blob requests
+BLOB_FETCH_LIMIT = 20
+BLOB_FETCH_WORKERS = 8        # Blob requests in flight at once
+
 st.set_page_config(page_title="JPJC SPhO Archive", layout="wide")
 
 # ==========================================
 # 🔐 ENCRYPTION HELPER
 # ==========================================
+# Both ciphers are built once per process (cache_resource) and shared by all sessions;
+# Fernet and AESGCM objects keep no per-call state, so concurrent use is safe.
+@st.cache_resource(show_spinner=False)
 def get_cipher():
-    """Returns the Fernet cipher using the key from secrets."""
+    """Returns the Fernet cipher using the key from secrets (built once per process)."""
     try:
         key = st.secrets["encryption_key"]
         return Fernet(key.encode() if isinstance(key, str) else key)
@@ -30,6 +57,32 @@ def get_cipher():
         st.error(f"Encryption Key Error: {e}")
         st.stop()
 
+@st.cache_resource(show_spinner=False)
+def get_aead():
+    """
+    AES-256-GCM cipher (one pass, hardware accelerated) with its own key, derived from
+    the Fernet key so no new secret is needed.
+    """
+    try:
+        key = st.secrets["encryption_key"]
+        hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=None, info=b"spo-aes-gcm")
+        return AESGCM(hkdf.derive(base64.urlsafe_b64decode(key)))
+    except Exception as e:
+        st.error(f"Encryption Key Error: {e}")
+        st.stop()
+
+def encrypt_bytes(data):
+    """GCM_HEADER + 12-byte random nonce + ciphertext."""
+    nonce = os.urandom(12)
+    return GCM_HEADER + nonce + get_aead().encrypt(nonce, data, None)
+
+def decrypt_bytes(data):
+    """Decrypts AES-GCM content, and Fernet tokens pushed before the switch."""
+    if data.startswith(GCM_HEADER):
+        nonce = data[len(GCM_HEADER):len(GCM_HEADER) + 12]
+        return get_aead().decrypt(nonce, data[len(GCM_HEADER) + 12:], None)
+    return get_cipher().decrypt(data)
+
 # ==========================================
 # 🔒 AUTHENTICATION LOGIC
 # ==========================================
@@ -66,130 +119,274 @@ if not current_role: st.stop()
 # ==========================================
 # 🐙 GITHUB SYNC (MULTI-FOLDER)
 # ==========================================
+# Rate-limited requests wait for the reset, but never stall the page longer than this
+GITHUB_MAX_RATE_LIMIT_WAIT = 120
+
+def github_retry():
+    """PyGithub's retry policy: sleeps out rate limits (403/429) and retries server errors."""
+    return GithubRetry(max_rate_limit_wait=GITHUB_MAX_RATE_LIMIT_WAIT, status_forcelist=[429, *range(500, 600)])
+
+@st.cache_resource(show_spinner=False)
+def get_github_repo():
+    """PyGithub repo handle, built once per process instead of once per push/pull."""
+    return Github(auth=Auth.Token(st.secrets["github_token"]), retry=github_retry()).get_repo(st.secrets["github_repo"])
+
+@st.cache_resource(show_spinner=False)
+def get_github_branch():
+    """Branch name, read from the secrets once per process."""
+    return st.secrets["github_branch"]
+
 def push_to_github(local_path, content, commit_message):
     """
     Encrypts content and pushes to GitHub.
     local_path example: 'Year/2023/exam.tex'
     """
     try:
-        auth_token = Auth.Token(st.secrets["github_token"])
-        g = Github(auth=auth_token)
-        repo = g.get_repo(st.secrets["github_repo"])
+        repo = get_github_repo()
         
         # 1. ENCRYPT CONTENT
-        cipher = get_cipher()
-        encrypted_data = cipher.encrypt(content.encode('utf-8'))
+        encrypted_data = encrypt_bytes(content.encode('utf-8'))
         
         # 2. PUSH
-        contents = repo.get_contents(local_path, ref=st.secrets["github_branch"])
+        contents = repo.get_contents(local_path, ref=get_github_branch())
         repo.update_file(
             path=contents.path,
             message=commit_message,
             content=encrypted_data,
             sha=contents.sha,
-            branch=st.secrets["github_branch"]
+            branch=get_github_branch()
         )
         return True, "Successfully encrypted and pushed to GitHub!"
     except Exception as e:
         return False, f"GitHub Error: {str(e)}"
 
+def dir_is_empty(path):
+    """True if path has no entries; stops at the first one instead of listing them all."""
+    with os.scandir(path) as it:
+        return next(it, None) is None
+
+def load_sync_state():
+    """Returns the {path: blob sha} map saved by the last sync ({} if there is none)."""
+    try:
+        with open(SYNC_STATE_FILE, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_sync_state(state):
+    """Writes the sync state atomically, so a crash never leaves half a file."""
+    tmp_path = SYNC_STATE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(state, f)
+    os.replace(tmp_path, SYNC_STATE_FILE)
+
 def pull_from_github():
     """
-    Loops through BASE_DIRS, wipes them locally, and re-downloads/decrypts from GitHub.
+    Syncs BASE_DIRS with GitHub, downloading/decrypting only new or changed files.
+    The blob sha of every file from the last sync is kept in SYNC_STATE_FILE, because
+    decrypted local files can't be hashed to compare with GitHub directly.
     """
     try:
-        auth_token = Auth.Token(st.secrets["github_token"])
-        g = Github(auth=auth_token)
-        repo = g.get_repo(st.secrets["github_repo"])
-        cipher = get_cipher()
+        repo = get_github_repo()
+        branch = get_github_branch()
         
-        total_files = 0
+        def decrypt(raw_data):
+            """Plaintext of raw_data; None if it is encrypted but fails to decrypt."""
+            if not raw_data.startswith((GCM_HEADER, FERNET_PREFIX)):
+                return raw_data # Not encrypted
+            try:
+                return decrypt_bytes(raw_data)
+            except (InvalidTag, InvalidToken):
+                return None
+        
+        # 1. List every file under BASE_DIRS in a single request
+        head_sha = repo.get_branch(branch).commit.sha
+        tree = repo.get_git_tree(head_sha, recursive=True)
+        # A truncated listing is missing files that do exist, so nothing is deleted on its word
+        if tree.truncated:
+            print("Warning: GitHub truncated the file tree; skipping local deletions.")
+        prefixes = tuple(f"{folder_name}/" for folder_name in BASE_DIRS.values())
+        remote = {e.path: e.sha for e in tree.tree if e.type == "blob" and e.path.startswith(prefixes)}
         
-        # Iterate over "topics" and "Year"
+        # 2. Remove local files (and emptied folders) that no longer exist on GitHub
         for label, folder_name in BASE_DIRS.items():
-            
-            # 1. Wipe Local Folder
-            if os.path.exists(folder_name):
-                shutil.rmtree(folder_name)
             os.makedirs(folder_name, exist_ok=True)
-            
-            # 2. Get Contents from GitHub (handle if folder missing in repo)
-            try:
-                contents = repo.get_contents(folder_name, ref=st.secrets["github_branch"])
-            except:
-                print(f"Warning: {folder_name} not found in GitHub repo.")
+            if tree.truncated:
                 continue
-
-            # 3. Recursive Download
-            while contents:
-                file_content = contents.pop(0)
-                if file_content.type == "dir":
-                    contents.extend(repo.get_contents(file_content.path, ref=st.secrets["github_branch"]))
-                else:
-                    local_path = file_content.path 
-                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                    
-                    raw_data = file_content.decoded_content
-                    
-                    # Decrypt logic
-                    try:
-                        decrypted_data = cipher.decrypt(raw_data)
-                    except Exception:
-                        decrypted_data = raw_data # Fallback if not encrypted
-                    
-                    with open(local_path, "wb") as f:
-                        f.write(decrypted_data)
-                    total_files += 1
-                    
-        return True, f"Sync complete! Processed {total_files} files across all folders."
+            for root, dirs, files in os.walk(folder_name, topdown=False):
+                for f in files:
+                    local_path = os.path.join(root, f).replace("\\", "/")
+                    if local_path not in remote:
+                        os.remove(local_path)
+                if root != folder_name and dir_is_empty(root):
+                    os.rmdir(root)
+        
+        # 3. Only files whose blob sha changed since the last sync (or that went missing) are fetched
+        state = load_sync_state()
+        if not tree.truncated:
+            state = {p: sha for p, sha in state.items() if p in remote}
+        changed = [p for p, sha in remote.items() if state.get(p) != sha or not os.path.exists(p)]
+        
+        saved = []
+        def save(local_path, raw_data):
+            data = decrypt(raw_data)
+            if data is None:
+                # Never written out as if it were plaintext; counted as failed below
+                print(f"⚠️ Could not decrypt {local_path} (wrong encryption_key or corrupted data)")
+                return
+            os.makedirs(os.path.dirname(local_path), exist_ok=True)
+            with open(local_path, "wb") as f:
+                f.write(data)
+            state[local_path] = remote[local_path]
+            saved.append(local_path)
+        
+        # Same rate-limit/server-error retries as PyGithub for the tarball and blob requests
+        session = requests.Session()
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=BLOB_FETCH_WORKERS, max_retries=github_retry()))
+        
+        if len(changed) > BLOB_FETCH_LIMIT:
+            # Many changes (e.g. first sync): one tarball stream beats one request per file
+            wanted = set(changed)
+            url = repo.get_archive_link("tarball", ref=head_sha)
+            with session, session.get(url, stream=True, timeout=120) as response:
+                response.raise_for_status()
+                with tarfile.open(fileobj=response.raw, mode="r|gz") as archive:
+                    for member in archive:
+                        # Members are named "<owner>-<repo>-<sha>/<path>"
+                        local_path = member.name.split("/", 1)[-1]
+                        if member.isfile() and local_path in wanted:
+                            save(local_path, archive.extractfile(member).read())
+        else:
+            # A few changes: one blob request each, overlapped instead of back to back.
+            # The raw media type returns the bytes as-is, with no base64 to decode.
+            session.headers.update({"Authorization": f"Bearer {st.secrets['github_token']}", "Accept": "application/vnd.github.raw"})
+            
+            def fetch_blob(path):
+                """The blob's bytes, or None if it couldn't be fetched (retried next sync)."""
+                try:
+                    response = session.get(f"https://api.github.com/repos/{repo.full_name}/git/blobs/{remote[path]}", timeout=60)
+                    response.raise_for_status()
+                    return response.content
+                except Exception as download_error:
+                    print(f"⚠️ Error downloading {path}: {download_error}")
+                    return None
+            
+            with session, ThreadPoolExecutor(max_workers=BLOB_FETCH_WORKERS) as pool:
+                for local_path, raw_data in zip(changed, pool.map(fetch_blob, changed)):
+                    if raw_data is not None:
+                        save(local_path, raw_data)
+        
+        save_sync_state(state)
+        total_files = len(saved)
+        unchanged = len(remote) - len(changed)
+        # Drop listings cached for the pre-sync folder versions
+        get_subfolders.clear()
+        get_files.clear()
+        msg = f"Sync complete! Downloaded {total_files} files ({unchanged} already up to date)."
+        if tree.truncated:
+            msg += " GitHub returned a partial file list, so no local files were removed."
+        if total_files < len(changed):
+            msg += f" {len(changed) - total_files} files failed and will be retried on the next sync."
+        return True, msg
     except Exception as e:
         return False, str(e)
 
-# --- AUTO-PULL CHECK ---
-# If "topics" is missing, we assume we need to pull everything (including Year)
-if not os.path.exists(BASE_DIRS["Topics"]) or not os.listdir(BASE_DIRS["Topics"]):
-    if "encryption_key" in st.secrets:
-        pull_from_github()
-
 # ==========================================
 # 🚀 HELPER FUNCTIONS
 # ==========================================
 
-def get_subfolders(root_dir):
-    """Returns list of subfolders (e.g., 'Kinematics', '2023')"""
+def dir_mtime(path):
+    """Folder mtime in ns (0 if missing); it changes when an entry is added, removed or renamed."""
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_subfolders(root_dir, mtime_ns):
+    """Returns list of subfolders (e.g., 'Kinematics', '2023'); mtime_ns keys the cache"""
     if not os.path.exists(root_dir): return []
-    return sorted([d for d in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, d))])
+    with os.scandir(root_dir) as it:
+        return sorted(e.name for e in it if e.is_dir())
 
-def get_files(root_dir, subfolder):
-    """Returns list of supported files in the specific subfolder"""
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_files(root_dir, subfolder, mtime_ns):
+    """Returns list of supported files in the specific subfolder; mtime_ns keys the cache"""
     target_path = os.path.join(root_dir, subfolder)
     allowed_extensions = ('.tex', '.pdf', '.jpg', '.jpeg', '.png')
-    return sorted([f for f in os.listdir(target_path) if f.lower().endswith(allowed_extensions)])
+    with os.scandir(target_path) as it:
+        return sorted(e.name for e in it if e.is_file() and e.name.lower().endswith(allowed_extensions))
+
+# --- AUTO-PULL CHECK ---
+# If "topics" is missing, we assume we need to pull everything (including Year)
+if not os.path.exists(BASE_DIRS["Topics"]) or dir_is_empty(BASE_DIRS["Topics"]):
+    if "encryption_key" in st.secrets:
+        pull_from_github()
+
+def source_hash(file_path):
+    """Content key of a .tex file; identical sources share one compiled PDF."""
+    with open(file_path, "rb") as f:
+        return hashlib.blake2b(f.read(), digest_size=16).hexdigest()
+
+@st.cache_resource(show_spinner=False)
+def sweep_pdf_cache():
+    """Startup sweep: keeps only the PDF_CACHE_MAX_ENTRIES most recently used PDFs."""
+    with os.scandir(TEMP_DIR) as it:
+        pdfs = sorted((e.stat().st_mtime, e.path) for e in it if e.is_file() and e.name.endswith(".pdf"))
+    for mtime, path in pdfs[:max(0, len(pdfs) - PDF_CACHE_MAX_ENTRIES)]:
+        os.unlink(path)
 
 def compile_latex(file_path):
-    file_name = os.path.basename(file_path)
-    job_name = os.path.splitext(file_name)[0]
     abs_temp_dir = os.path.abspath(TEMP_DIR)
     
     try:
-        process = subprocess.run(
-            [
-                "pdflatex", 
-                "-interaction=nonstopmode", 
-                f"-output-directory={abs_temp_dir}",
-                f"-jobname={job_name}",
-                file_path
-            ],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        pdf_path = os.path.join(abs_temp_dir, f"{job_name}.pdf")
-        if process.returncode == 0 and os.path.exists(pdf_path):
+        # A PDF built from byte-identical source is reused without running pdflatex
+        key = source_hash(file_path)
+        pdf_path = os.path.join(abs_temp_dir, f"{key}.pdf")
+        if os.path.exists(pdf_path):
+            os.utime(pdf_path) # Mark as recently used for the sweep
             return pdf_path, None
-        else:
-            return None, process.stdout
+        
+        job_name = f"_build_{key}"
+        # The log goes to a temp file and is only decoded if the compile fails
+        with tempfile.TemporaryFile() as log_file:
+            process = subprocess.run(
+                [
+                    "pdflatex", 
+                    "-interaction=nonstopmode",
+                    "-halt-on-error",
+                    "-no-shell-escape",
+                    "-file-line-error",
+                    f"-output-directory={abs_temp_dir}",
+                    f"-jobname={job_name}",
+                    file_path
+                ],
+                stdout=log_file, stderr=subprocess.STDOUT
+            )
+            build_path = os.path.join(abs_temp_dir, f"{job_name}.pdf")
+            if process.returncode == 0 and os.path.exists(build_path):
+                os.replace(build_path, pdf_path)
+                return pdf_path, None
+            else:
+                log_file.seek(0)
+                return None, log_file.read().decode("utf-8", "replace")
     except Exception as e:
         return None, str(e)
 
+@st.cache_data(max_entries=16, show_spinner=False)
+def read_pdf_bytes(pdf_path, mtime):
+    """Maps the PDF once per version; reruns reuse the cached bytes."""
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return bytes(mm)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def read_text(path, mtime_ns, size):
+    """Reads a source file once per version (mtime_ns and size are part of the cache key)."""
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+sweep_pdf_cache()
+
 # ==========================================
 # 🖥️ SIDEBAR NAVIGATION
 # ==========================================
@@ -217,7 +414,7 @@ browse_mode = st.sidebar.radio("Library Section:", ["Topics", "Year"], horizonta
 current_root_dir = BASE_DIRS[browse_mode] # "topics" or "Year"
 
 # 2. SELECT SUBFOLDER (e.g., "Kinematics" or "2023")
-subfolders = get_subfolders(current_root_dir)
+subfolders = get_subfolders(current_root_dir, dir_mtime(current_root_dir))
 
 if not subfolders:
     st.sidebar.error(f"No folders found in '{current_root_dir}'.")
@@ -228,7 +425,10 @@ selected_subfolder = st.sidebar.selectbox(f"Select {browse_mode[:-1]}", subfolde
 #st.sidebar.markdown("---") 
 
 # 3. SELECT FILE
-files = get_files(current_root_dir, selected_subfolder)
+files = get_files(
+    current_root_dir, selected_subfolder,
+    dir_mtime(os.path.join(current_root_dir, selected_subfolder))
+)
 
 if not files:
     st.sidebar.warning("No files found.")
@@ -255,7 +455,11 @@ is_tex = file_ext == 'tex'
 if "force_recompile" not in st.session_state: st.session_state.force_recompile = False
 if "last_processed" not in st.session_state: st.session_state.last_processed = None
 
-if st.session_state.last_processed != rel_path or st.session_state.force_recompile:
+# Keyed on the file's stat too (one syscall, no read), so a file changed by a sync is
+# reloaded while it stays selected; compile_latex's content key still reuses the PDF
+selection_stat = os.stat(abs_path)
+selection = (rel_path, selection_stat.st_ino, selection_stat.st_mtime_ns, selection_stat.st_size)
+if st.session_state.last_processed != selection or st.session_state.force_recompile:
     st.session_state.current_pdf = None
     st.session_state.compilation_error = None
     
@@ -267,7 +471,7 @@ if st.session_state.last_processed != rel_path or st.session_state.force_recompi
             st.session_state.current_pdf = pdf
             st.session_state.compilation_error = log
             
-    st.session_state.last_processed = rel_path
+    st.session_state.last_processed = selection
     st.session_state.force_recompile = False
 
 # TABS
@@ -280,13 +484,14 @@ with tab_view:
         st.success(f"**{selected_file}** loaded.")
         st.image(abs_path, caption=selected_file, use_container_width=True)
     elif st.session_state.current_pdf and os.path.exists(st.session_state.current_pdf):
+        # One cached read feeds both the download button and the viewer
+        pdf_bytes = read_pdf_bytes(st.session_state.current_pdf, os.path.getmtime(st.session_state.current_pdf))
         col1, col2 = st.columns([6, 1])
         with col1: st.success(f"**{selected_file}** loaded.")
         with col2:
-            with open(st.session_state.current_pdf, "rb") as f:
-                st.download_button("⬇️ PDF", f, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
+            st.download_button("⬇️ PDF", pdf_bytes, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
         st.markdown("---")
-        pdf_viewer(st.session_state.current_pdf, width=800, height=1000)
+        pdf_viewer(pdf_bytes, width=800, height=1000)
     elif st.session_state.compilation_error:
         st.error("⚠️ Compilation Failed")
         with st.expander("Error Log"):
@@ -298,8 +503,8 @@ with tab_edit:
         st.info(f"Binary file ({file_ext.upper()}) cannot be edited directly.")
     else:
         # Read file
-        with open(abs_path, "r", encoding="utf-8") as f:
-            file_content = f.read()
+        source_stat = os.stat(abs_path)
+        file_content = read_text(abs_path, source_stat.st_mtime_ns, source_stat.st_size)
 
         if current_role == 'admin':
             st.warning(f"⚠️ You are editing: {rel_path}")
@@ -324,6 +529,7 @@ with tab_edit:
                         )
                     if success:
                         st.success(msg)
+                        read_text.clear()
                         st.session_state.force_recompile = True
                         st.rerun()
                     else:
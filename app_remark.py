@@ -1,14 +1,33 @@
 import streamlit as st  # The main library for building the web interface
+import streamlit.components.v1 as components  # Embeds other web pages (used to show PDFs)
+from streamlit.errors import StreamlitAPIException  # Raised when secrets.toml can't be read
 import os               # Used for operating system interactions (file paths, folders)
 import subprocess       # Used to run external commands (like the LaTeX compiler)
-from streamlit_pdf_viewer import pdf_viewer  # A special component to display PDFs in the app
-from github import Github, Auth  # Libraries to interact with the GitHub API
+import time             # Used to pause briefly while waiting for a background job
+import functools        # Provides lru_cache, which remembers a function's results
+import hmac             # Provides compare_digest, a timing-safe way to compare passwords
+import secrets          # Makes random, unguessable names (for published PDFs)
+import threading        # Gives each thread an id, used to make unique temporary file names
+from PIL import Image, ImageOps  # Pillow, used to shrink large images once (at sync or first compile)
 import shutil           # High-level file operations (used here to delete entire folders)
+import hashlib          # Standard hash functions (SHA-1 for Git file IDs, SHA-256 for passwords)
+import re               # Regular expressions, used to find where a document's preamble ends
+import html             # Escapes text (<, >, &) so it can be shown safely inside HTML
+import requests         # Simple HTTP client, used to download raw files from GitHub
+from urllib.parse import quote  # Makes file paths with spaces safe to put in a URL
+from concurrent.futures import ThreadPoolExecutor  # Runs many downloads at the same time
+from collections import Counter, defaultdict, deque  # Counter counts things; defaultdict fills in missing keys automatically
+import mmap             # Memory-maps files so the OS page cache serves their bytes directly
+import xxhash           # Very fast (non-cryptographic) hashing, used to fingerprint .tex files
+from pygments import highlight  # Pygments colours source code (the same library st.code uses)
+from pygments.lexers import TexLexer
+from pygments.formatters import HtmlFormatter
 
 # ==========================================
 # 🛠️ HELPER FUNCTIONS
 # ==========================================
 
+@functools.lru_cache(maxsize=32) # Look each key up once, then reuse the answer
 def get_secret(key):
     """
     Retrieves sensitive data (passwords, tokens) safely.
@@ -21,11 +40,13 @@ def get_secret(key):
         return os.environ[key]
 
     # 2. Check if the key exists in the local secrets file
-    # We use a try-except block to prevent the app from crashing if secrets.toml is missing.
+    # We use a try-except block to prevent the app from crashing if secrets.toml is missing
+    # (FileNotFoundError) or can't be parsed (StreamlitAPIException). Any other error is a
+    # real bug, so we let it surface instead of silently returning None.
     try:
         if key in st.secrets:
             return st.secrets[key]
-    except Exception:
+    except (FileNotFoundError, StreamlitAPIException):
         pass
 
     # If the key isn't found anywhere, return None
@@ -45,10 +66,65 @@ BASE_DIRS = {
 }
 
 # Create a temporary folder to store compiled PDF files.
+# On Linux, /dev/shm is a 'RAM disk' (tmpfs): files there live in memory, not on the hard drive.
+# pdflatex writes and re-reads many helper files (.aux, .log), so building in RAM is much faster.
+# If /dev/shm is missing (Windows/macOS), we fall back to a normal folder.
+if os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK):
+    TEMP_DIR = "/dev/shm/spo_build"
+else:
+    TEMP_DIR = "temp_build"
 # exist_ok=True means "don't crash if this folder already exists".
-TEMP_DIR = "temp_build"
 os.makedirs(TEMP_DIR, exist_ok=True)
 
+# Finished PDFs are copied into ./static/pdfs. With 'enableStaticServing' switched on in
+# .streamlit/config.toml, Streamlit's web server hands these files to the browser itself
+# (at the address app/static/pdfs/<name>), so Python never has to send the bytes.
+# Note: static files are served WITHOUT the login check. Anyone who has a PDF's address
+# can open it. That is why each session publishes under its own random name (see
+# publish_pdf): nobody can work out the address from the document. An address that leaks
+# (e.g. from the browser history) still works until the file is cleaned up.
+STATIC_PDF_DIR = os.path.join("static", "pdfs")
+os.makedirs(STATIC_PDF_DIR, exist_ok=True)
+
+# Documents with \ref or \tableofcontents need several pdflatex passes.
+# 'latexmk' runs exactly as many passes as needed, so we prefer it when installed.
+# shutil.which returns the program's path, or None if it isn't installed.
+LATEXMK = shutil.which("latexmk")
+# A failed compile can print a huge log, but the error is near the end.
+# We keep only this many of the last lines to show the user.
+LOG_TAIL_LINES = 400
+# Name of the output files inside a document's build folder (_build.pdf, _build.aux, ...)
+BUILD_JOB_NAME = "_build"
+# Options for every compile pass:
+# -interaction=nonstopmode: don't pause on errors (batchmode would also hide the
+#   terminal output that our error view is built from)
+# -halt-on-error: stop at the first error, since nothing after it is useful
+# -no-shell-escape: never let a document run shell commands
+# -file-line-error: errors read "file:line: message", easy to find in the source
+LATEX_FLAGS = ["-interaction=nonstopmode", "-halt-on-error", "-no-shell-escape", "-file-line-error"]
+
+# Image types that a .tex file may pull in from its own folder
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+# Decoding a big photo is often the slowest part of a compile. When a large image is
+# downloaded (or first compiled), we save a smaller copy in IMAGE_CACHE_DIR (same relative path as the
+# original), and pdflatex is told to look there first. The original is never changed,
+# so the sync can still compare it with GitHub.
+IMAGE_CACHE_DIR = "image_cache"
+IMAGE_MAX_SIZE = (1600, 1600)           # Largest width/height (pixels) of the smaller copy
+IMAGE_OPTIMIZE_MIN_BYTES = 200 * 1024   # Images under 200 KB are left alone
+
+# Loading big packages like tikz takes pdflatex a noticeable moment on EVERY compile.
+# The Docker image builds 'spo.fmt' from spo_preamble.ltx: a snapshot of LaTeX with the
+# common packages already loaded. Starting pdflatex from that snapshot skips the loading.
+# If the file isn't there (e.g. running locally), FMT_ARGS is empty and nothing changes.
+SPO_FMT = os.path.abspath("spo.fmt")
+FMT_ARGS = [f"-fmt={SPO_FMT}"] if os.path.exists(SPO_FMT) else []
+# Documents whose preamble is shared with other documents also get a format of their own
+# (see preamble_format). Each one is several MB, so they are kept on the normal disk
+# rather than in the RAM disk, and only the PREAMBLE_FMT_MAX_ENTRIES most used are kept.
+PREAMBLE_FMT_DIR = "fmt_cache"
+PREAMBLE_FMT_MAX_ENTRIES = 8
+
 # Set up the browser tab title and layout width
 st.set_page_config(page_title="JPJC SPhO Archive", layout="wide")
 
@@ -56,6 +132,42 @@ st.set_page_config(page_title="JPJC SPhO Archive", layout="wide")
 # 🔐 AUTHENTICATION LOGIC
 # ==========================================
 
+# The roles a password can unlock, with the name shown after logging in.
+# Each role's password is stored as the secret '<role>_password'.
+ROLE_LABELS = {"admin": "Administrator", "viewer": "Viewer"}
+
+@st.cache_resource
+def get_password_table():
+    """
+    Returns {role: SHA-256 digest of its password}, built only once while the server runs.
+    Roles whose password isn't configured are left out, so nothing can match them.
+
+    The secrets can hold either:
+    - <role>_password_sha256: the password's SHA-256 as hex (preferred: the real password
+      is then not stored anywhere), e.g. from: python -c "import hashlib; print(hashlib.sha256(b'pw').hexdigest())"
+    - <role>_password: the plain password, which we hash here ourselves.
+    A <role>_password_sha256 that isn't a valid SHA-256 hex string is ignored (with a
+    warning in the server log), so that role can't log in until it is fixed.
+    """
+    table = {}
+    for role in ROLE_LABELS:
+        hashed = get_secret(f"{role}_password_sha256")
+        password = get_secret(f"{role}_password")
+        if hashed is not None:
+            try:
+                digest = bytes.fromhex(str(hashed).strip()) # Hex text -> the 32 raw bytes
+                if len(digest) != hashlib.sha256().digest_size: # e.g. a truncated copy-paste
+                    raise ValueError("not a SHA-256 digest")
+            except ValueError as e:
+                # Fail closed: a broken entry must never let anyone in, and we don't fall
+                # back to the plain password either (the admin clearly meant to replace it)
+                print(f"⚠️ Ignoring {role}_password_sha256: {e}")
+                continue
+            table[role] = digest
+        elif password is not None:
+            table[role] = hashlib.sha256(str(password).encode()).digest()
+    return table
+
 def check_login():
     """
     Handles user login. Returns the role ('admin' or 'viewer') if logged in.
@@ -79,15 +191,18 @@ def check_login():
         submit_button = st.form_submit_button("Login")
 
         if submit_button:
-            # Check against the admin password
-            if password_input == get_secret("admin_password"):  
-                st.session_state.user_role = "admin"
-                st.success("Logged in as Administrator")
-                st.rerun() # Reload the app to update the view
-            # Check against the viewer password
-            elif password_input == get_secret("viewer_password"):  
-                st.session_state.user_role = "viewer"
-                st.success("Logged in as Viewer")
+            # Hash what was typed the same way, then compare digests (always 32 bytes long)
+            digest = hashlib.sha256(password_input.encode()).digest()
+            role = None
+            # A normal == stops at the first wrong character, so an attacker could time it
+            # to guess the password letter by letter. hmac.compare_digest always takes the
+            # same time. We also check EVERY role, so the timing doesn't reveal which matched.
+            for candidate, expected in get_password_table().items():
+                if hmac.compare_digest(digest, expected) and role is None:
+                    role = candidate # The first match wins (admin is listed first)
+            if role:
+                st.session_state.user_role = role
+                st.success(f"Logged in as {ROLE_LABELS[role]}")
                 st.rerun() # Reload the app to update the view
             else:
                 st.error("❌ Invalid Password")
@@ -103,167 +218,1016 @@ if not current_role: st.stop()
 # 🐙 GITHUB SYNC (MULTI-FOLDER)
 # ==========================================
 
+# When GitHub's rate limit is hit, wait for it to reset (GitHub says when, in the
+# Retry-After or X-RateLimit-Reset header) and try again. But never keep the page
+# waiting longer than this many seconds; then the error is shown instead.
+GITHUB_MAX_RATE_LIMIT_WAIT = 120
+# How many files a sync downloads at the same time. Downloads mostly wait on the
+# network, so threads overlap them well; the session keeps one connection per worker.
+DOWNLOAD_WORKERS = 16
+# Each download is read and saved in pieces of this many bytes (64 KB)
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+def github_retry():
+    """
+    Returns PyGithub's retry policy: it recognises GitHub's rate-limit replies (403 with a
+    rate-limit message, or 429) and sleeps until the limit resets before retrying.
+    Temporary server errors (5xx) are retried too, after a short pause.
+    """
+    # PyGithub (the library for the GitHub API) is imported here, on first use, rather than
+    # at the top of the file: starting the app is faster, and visitors who only read
+    # documents never need it. Python remembers imported modules, so later calls are free.
+    from github import GithubRetry
+    return GithubRetry(max_rate_limit_wait=GITHUB_MAX_RATE_LIMIT_WAIT, status_forcelist=[429, *range(500, 600)])
+
+@st.cache_resource(show_spinner=False)
+def get_github_repo():
+    """
+    Connects to GitHub and returns the repository object.
+    Connecting costs a network request, so cache_resource keeps the connection
+    and every later push (from any user) reuses it.
+    """
+    from github import Github, Auth # Imported on first use (see github_retry)
+    return Github(auth=Auth.Token(get_secret("github_token")), retry=github_retry()).get_repo(get_secret("github_repo"))
+
+@st.cache_resource(show_spinner=False)
+def get_remote_shas():
+    """
+    Remembers each file's blob sha (its ID on GitHub) as of the last sync or push.
+    Filled in by pull_from_github and kept up to date by push_many, so a push can
+    tell which files GitHub already has without asking.
+    The same dictionary is shared by all users (cache_resource).
+    """
+    return {}
+
 def push_to_github(local_path, content, commit_message):
     """
     Uploads changes made in the Streamlit app back to GitHub.
+    A single file is simply a batch of one, so this hands it to push_many.
     
     Args:
         local_path: The file path (e.g., 'topics/Kinematics/notes.tex')
         content: The text content to write to the file.
         commit_message: A note describing the change.
     """
+    return push_many([(local_path, content)], commit_message)
+
+def push_many(changes, commit_message):
+    """
+    Uploads several files to GitHub as ONE commit.
+    The Contents API (update_file) needs a request or two per file; this needs the
+    same few requests however many files there are, which keeps us far below
+    GitHub's rate limits.
+
+    Args:
+        changes: A list of (path, text content) pairs.
+        commit_message: A note describing the change.
+    """
+    # Imported on first use (see github_retry). GithubException is raised when GitHub
+    # answers with an error (it carries the HTTP status).
+    from github import GithubException, InputGitTreeElement
     try:
-        # Authenticate with GitHub using the token
-        auth_token = Auth.Token(get_secret("github_token"))
-        g = Github(auth=auth_token)
-        repo = g.get_repo(get_secret("github_repo"))
-        
-        # 1. GET CONTENT REF
-        # To update a file on GitHub, we first need to get its 'sha' (ID).
-        # This confirms we are updating the specific version of the file we think we are.
-        contents = repo.get_contents(local_path, ref=get_secret("github_branch"))
-        
-        # 2. PUSH UPDATE
-        repo.update_file(
-            path=contents.path,
-            message=commit_message,
-            content=content, 
-            sha=contents.sha,
-            branch=get_secret("github_branch")
-        )
-        return True, "Successfully pushed to GitHub!"
+        repo = get_github_repo()
+        remote_shas = get_remote_shas()
+        # A blob's sha depends only on its content, so we can work out the new ones ourselves
+        blob_shas = {path: git_blob_sha_of(content.encode("utf-8")) for path, content in changes}
+        # Skip files GitHub already has exactly (as of the last sync or push)
+        changes = [(path, content) for path, content in changes if remote_shas.get(path) != blob_shas[path]]
+        if not changes:
+            return True, "GitHub already has this version; nothing to push."
+        # Describe the new files; GitHub stores their content as it builds the tree
+        elements = [InputGitTreeElement(path, "100644", "blob", content=content) for path, content in changes]
+        # A 'ref' is the branch pointer; it tells us the latest commit on the branch
+        ref = repo.get_git_ref(f"heads/{get_secret('github_branch')}")
+        for attempt in range(2): # At most one retry (see below)
+            parent = repo.get_git_commit(ref.object.sha)
+            # The new tree is the parent's tree with our files replaced
+            tree = repo.create_git_tree(elements, parent.tree)
+            if tree.sha == parent.tree.sha:
+                # Identical tree: GitHub already had these files, and a commit would be empty
+                break
+            commit = repo.create_git_commit(commit_message, tree, [parent])
+            try:
+                # Move the branch to the new commit. This is not forced, so if someone
+                # else pushed in the meantime, GitHub refuses (422)...
+                ref.edit(commit.sha)
+                break
+            except GithubException as e:
+                if attempt or e.status != 422:
+                    raise
+                # ...and we build our commit again, once, on top of their latest commit
+                ref = repo.get_git_ref(f"heads/{get_secret('github_branch')}")
+        remote_shas.update((path, blob_shas[path]) for path, content in changes)
+        if len(changes) == 1:
+            return True, "Successfully pushed to GitHub!"
+        return True, f"Successfully pushed {len(changes)} files to GitHub!"
     except Exception as e:
         return False, f"GitHub Error: {str(e)}"
 
+def download_raw_file(session, repo_name, branch, path):
+    """
+    Downloads one file from raw.githubusercontent.com and saves it at path.
+    Unlike the Contents API, this returns the file as-is (no base64 decoding needed).
+    stream=True hands us the download in small pieces as they arrive, so even a big
+    PDF or image is never held in memory all at once.
+    """
+    # quote() turns spaces etc. into URL-safe codes (e.g. 'Bohr Model' -> 'Bohr%20Model')
+    url = f"https://raw.githubusercontent.com/{repo_name}/{quote(branch)}/{quote(path)}"
+    with session.get(url, stream=True, timeout=60) as response:
+        response.raise_for_status() # Turn HTTP errors (404, 403...) into Python exceptions
+        write_file(path, response.iter_content(DOWNLOAD_CHUNK_SIZE))
+
+def list_remote_tree(session, repo_name, branch):
+    """
+    Asks GitHub's Git Trees API for every file on the branch in one request.
+    The answer is plain JSON: a 'tree' list with each file's 'path', 'type' and 'sha'.
+    """
+    url = f"https://api.github.com/repos/{repo_name}/git/trees/{quote(branch)}"
+    # recursive=1 includes the contents of every subfolder, not just the top level
+    response = session.get(url, params={"recursive": "1"}, timeout=60)
+    response.raise_for_status() # Turn an HTTP error (e.g. 404) into an exception
+    return response.json()
+
+def write_file(path, chunks):
+    """
+    Saves a sequence of byte chunks to a file using the operating system's own calls
+    (os.open / os.write), skipping the extra buffering layer that Python's open() adds.
+    The chunks go into a temporary '.part' file that replaces the real one only once
+    everything is written, so a download that fails halfway keeps the old version.
+    """
+    part_path = f"{path}.part"
+    # O_TRUNC empties an existing file first; O_BINARY (Windows only) stops newline conversion
+    fd = os.open(part_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, "O_BINARY", 0), 0o644)
+    try:
+        for chunk in chunks:
+            view = memoryview(chunk) # A 'view' lets us slice the bytes without copying them
+            while view:
+                # os.write may write only part of the data; it returns how much, so loop until done
+                view = view[os.write(fd, view):]
+    except BaseException:
+        # Something went wrong (e.g. the connection dropped): throw the partial file away
+        os.close(fd)
+        # remove_quietly ignores a .part file that is already gone, so the original
+        # error (the one 'raise' passes on) isn't replaced by a FileNotFoundError
+        remove_quietly(part_path)
+        raise
+    os.close(fd)
+    os.replace(part_path, path) # Swap the finished file in (a single, atomic step)
+
+def git_blob_sha_of(data):
+    """
+    Computes the same ID ('blob sha') that Git gives a file: SHA-1 of 'blob <size>\\0' + content.
+    If two IDs are equal, the two contents are byte-for-byte identical.
+    """
+    h = hashlib.sha1(f"blob {len(data)}\0".encode())
+    h.update(data)
+    return h.hexdigest()
+
+def git_blob_sha(path):
+    """The blob sha of a local file, to compare with the one GitHub lists for it."""
+    with open(path, "rb") as f:
+        return git_blob_sha_of(f.read())
+
+def dir_is_empty(path):
+    """
+    True if the folder has nothing in it.
+    os.listdir would build the full list of names just to check its length;
+    os.scandir lets us stop as soon as we see the first entry.
+    """
+    with os.scandir(path) as it:
+        return next(it, None) is None
+
+def optimize_image(path):
+    """
+    Saves a smaller copy of an image in IMAGE_CACHE_DIR.
+    The copy is at most IMAGE_MAX_SIZE pixels and has no EXIF metadata (camera info).
+    Small images don't need a copy, so any old one is removed.
+    """
+    cached_path = os.path.join(IMAGE_CACHE_DIR, path)
+    if os.path.getsize(path) < IMAGE_OPTIMIZE_MIN_BYTES:
+        if os.path.exists(cached_path):
+            os.remove(cached_path)
+        return
+    os.makedirs(os.path.dirname(cached_path), exist_ok=True)
+    # Save under a temporary name, then rename it into place in one step,
+    # so a pdflatex running at the same moment never reads half an image
+    tmp_path = f"{cached_path}.{threading.get_ident()}.tmp"
+    with Image.open(path) as original:
+        img_format = original.format # "JPEG" or "PNG", read from the file itself
+        # Phones store 'rotate this photo' in EXIF; apply it now, because the copy has no EXIF
+        img = ImageOps.exif_transpose(original)
+        img.thumbnail(IMAGE_MAX_SIZE) # Shrinks in place, keeping the aspect ratio
+        if img_format == "JPEG":
+            img.save(tmp_path, "JPEG", quality=85, optimize=True)
+        else:
+            img.save(tmp_path, "PNG", optimize=True)
+    os.replace(tmp_path, cached_path)
+
+def optimize_folder_images(folder):
+    """
+    Makes the smaller copies for a folder's images, if they don't have an up-to-date one yet.
+    The sync only shrinks images it downloads, so images that came with the Docker image
+    (or that a sync left alone) would otherwise never get a copy. compile_latex calls
+    this before each real compile, so every document's images are covered.
+    """
+    with os.scandir(folder) as it:
+        images = [e for e in it if e.is_file() and e.name.lower().endswith(IMAGE_EXTENSIONS)]
+    for e in images:
+        path = os.path.relpath(e.path) # e.g. 'topics/Bohr Model/photo.jpg', like the sync uses
+        try:
+            # The copy is up to date if it is newer than the original
+            if os.stat(os.path.join(IMAGE_CACHE_DIR, path)).st_mtime_ns >= e.stat().st_mtime_ns:
+                continue
+        except FileNotFoundError:
+            pass # No copy yet (small images never get one; optimize_image just returns)
+        try:
+            optimize_image(path)
+        except Exception as image_error:
+            # A broken image shouldn't stop the compile; pdflatex will use the original
+            print(f"⚠️ Could not optimize {path}: {image_error}")
+
 def pull_from_github():
     """
-    Downloads all files from GitHub to the local Streamlit server.
-    This effectively 'resets' the local files to match the master copy on GitHub.
+    Makes the local files match the master copy on GitHub.
+    Only files that are new or changed are downloaded; the rest are left alone.
     """
     try:
         # Connect to GitHub
-        auth_token = Auth.Token(get_secret("github_token"))
-        g = Github(auth=auth_token)
-        repo = g.get_repo(get_secret("github_repo"))
+        token = get_secret("github_token")
+        repo_name = get_secret("github_repo")
+        branch = get_secret("github_branch")
+        # A Session re-uses the same internet connection for many requests.
+        # We call GitHub directly with it; PyGithub is only used for pushing edits.
+        session = requests.Session()
+        session.headers.update({"Authorization": f"Bearer {token}"})
+        # Give the session the same rate-limit handling as PyGithub, and enough pooled
+        # connections for all download workers (the default pool keeps only 10)
+        session.mount("https://", requests.adapters.HTTPAdapter(pool_maxsize=DOWNLOAD_WORKERS, max_retries=github_retry()))
         
-        total_files = 0
+        # 1. List Every File (one request)
+        # The Git Trees API returns the whole folder structure of the branch at once,
+        # including each file's 'sha' (its content ID).
+        tree = list_remote_tree(session, repo_name, branch)
+        # GitHub only cuts the list short for very large repositories. A cut-short list
+        # leaves out files that DO exist, so in that case we must not delete anything
+        # just because it is missing from the list.
+        truncated = bool(tree.get("truncated"))
+        if truncated:
+            print("Warning: GitHub truncated the file tree; skipping local deletions.")
+        # Keep only files ('blobs') inside our folders, e.g. 'topics/...' or 'year/...'
+        prefixes = tuple(f"{folder_name}/" for folder_name in BASE_DIRS.values())
+        remote = {e["path"]: e["sha"] for e in tree["tree"] if e["type"] == "blob" and e["path"].startswith(prefixes)}
+        # Remember every file's sha for push_many
+        remote_shas = get_remote_shas()
+        if not truncated: # A partial list would forget the shas of the files left out
+            remote_shas.clear()
+        remote_shas.update(remote)
         
-        # Loop through our defined folders ("topics" and "year")
+        # 2. Remove Deleted Files
+        # Collect every local file, then delete the ones that are no longer on GitHub.
+        local_paths = set()
         for label, folder_name in BASE_DIRS.items():
-            
-            # 1. Wipe Local Folder
-            # We delete the existing local folder to ensure no old/deleted files remain.
-            if os.path.exists(folder_name):
-                shutil.rmtree(folder_name)
-            # Re-create the empty folder
             os.makedirs(folder_name, exist_ok=True)
-            
-            # 2. Get the list of files/folders from GitHub
+            for root, dirs, files in os.walk(folder_name):
+                # GitHub paths always use '/', so we do the same (Windows uses a backslash)
+                local_paths.update(os.path.join(root, f).replace("\\", "/") for f in files)
+        if not truncated: # Skipped for a partial list (see above)
+            for local_path in local_paths - remote.keys():
+                os.remove(local_path)
+                # Also remove its smaller copy, if it had one
+                cached_path = os.path.join(IMAGE_CACHE_DIR, local_path)
+                if os.path.exists(cached_path):
+                    os.remove(cached_path)
+            # Remove subfolders that are now empty (bottom-up, so nested folders go first)
+            for label, folder_name in BASE_DIRS.items():
+                for root, dirs, files in os.walk(folder_name, topdown=False):
+                    if root != folder_name and dir_is_empty(root):
+                        os.rmdir(root)
+        
+        # 3. Decide What To Download
+        # A file is downloaded only if it is new, or its content ID differs from GitHub's.
+        paths = [p for p, sha in remote.items() if p not in local_paths or git_blob_sha(p) != sha]
+        # Create every needed subfolder once (a 'set' removes duplicates)
+        for folder in {os.path.dirname(p) for p in paths}:
+            os.makedirs(folder, exist_ok=True)
+        
+        # 4. Parallel Download
+        # Each worker downloads one file AND writes it to disk itself, so saving one file
+        # overlaps with the downloads still running in the other workers.
+        def fetch(path):
+            """Returns True if the file was saved, False if its download failed."""
             try:
-                contents = repo.get_contents(folder_name, ref=get_secret("github_branch"))
-            except Exception as e:
-                # If the folder doesn't exist on GitHub, log a warning and skip it
-                print(f"Warning: {folder_name} not found. {e}")
-                continue
-
-            # 3. Recursive Download
-            # We use a 'while' loop to process files. If we find a folder, 
-            # we add its contents to the list to process later.
-            while contents:
-                file_content = contents.pop(0)
-                if file_content.type == "dir":
-                    # If it's a directory, fetch its contents and add to our processing queue
-                    contents.extend(repo.get_contents(file_content.path, ref=get_secret("github_branch")))
-                else:
-                    # If it's a file, we need to save it.
-                    local_path = file_content.path 
-                    # Ensure the subfolder exists locally
-                    os.makedirs(os.path.dirname(local_path), exist_ok=True)
-                    
-                    # --- ROBUST CONTENT DECODING ---
-                    # GitHub sends files in different ways. We must handle them all.
-                    try:
-                        # Case A: Standard Base64 encoded file (Images, PDFs, most code)
-                        if file_content.encoding == "base64":
-                            raw_data = file_content.decoded_content
-                        
-                        # Case B: 'none' encoding (Often occurs with empty files or raw text)
-                        elif file_content.encoding == "none" or file_content.encoding is None:
-                            # Use the raw content string if available, otherwise empty bytes
-                            raw_data = (file_content.content or "").encode('utf-8')
-                        
-                        # Case C: Fallback for any other unexpected encoding
-                        else:
-                            raw_data = file_content.decoded_content
-                            
-                    except Exception as decode_error:
-                        print(f"⚠️ Error downloading {local_path}: {decode_error}")
-                        continue
-
-                    # Write the raw bytes to the local hard drive
-                    with open(local_path, "wb") as f:
-                        f.write(raw_data)
-                    total_files += 1
+                # Downloads the file and writes it to the local hard drive
+                download_raw_file(session, repo_name, branch, path)
+            except Exception as download_error:
+                print(f"⚠️ Error downloading {path}: {download_error}")
+                return False # Skip this file, but keep going with the others
+            # Shrink large images now, once, instead of in every compile
+            if path.lower().endswith(IMAGE_EXTENSIONS):
+                try:
+                    optimize_image(path)
+                except Exception as image_error:
+                    # A broken image shouldn't stop the sync; pdflatex will use the original
+                    print(f"⚠️ Could not optimize {path}: {image_error}")
+            return True
+        
+        # The pool runs up to DOWNLOAD_WORKERS downloads at once. True counts as 1 in
+        # sum(), so this adds up the number of files that were saved.
+        with ThreadPoolExecutor(max_workers=DOWNLOAD_WORKERS) as pool:
+            total_files = sum(pool.map(fetch, paths))
                     
-        return True, f"Sync complete! Processed {total_files} files."
+        unchanged = len(remote) - len(paths)
+        # Drop listings cached for the folders as they were before the sync
+        get_subfolders.clear()
+        get_files.clear()
+        get_shared_preamble_keys.clear() # New or changed files may share other preambles
+        msg = f"Sync complete! Downloaded {total_files} files ({unchanged} already up to date)."
+        if truncated:
+            # Tell the admin, so a file deleted on GitHub that is still here isn't a mystery
+            msg += " GitHub returned a partial file list, so no local files were removed."
+        return True, msg
     except Exception as e:
         return False, str(e)
 
-# --- AUTO-PULL CHECK ---
-# If the "Topics" folder is missing or empty when the app starts, 
-# automatically try to download everything from GitHub.
-if not os.path.exists(BASE_DIRS["Topics"]) or not os.listdir(BASE_DIRS["Topics"]):
-    pull_from_github()
-
 # ==========================================
 # 🚀 FILE SYSTEM HELPERS
 # ==========================================
 
-def get_subfolders(root_dir):
-    """Returns a sorted list of subfolders inside a given directory."""
+def dir_mtime(path):
+    """
+    The folder's modification time in nanoseconds (0 if it doesn't exist).
+    A folder's mtime changes whenever something inside it is added, removed or renamed,
+    so it tells the listing caches below when their answer is out of date.
+    """
+    try:
+        return os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return 0
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_subfolders(root_dir, mtime_ns):
+    """
+    Returns a sorted list of subfolders inside a given directory.
+    mtime_ns (from dir_mtime) is part of the cache key: clicking around the sidebar
+    reuses the cached list, and it is re-read only after the folder changes.
+    """
     if not os.path.exists(root_dir): return []
-    return sorted([d for d in os.listdir(root_dir) if os.path.isdir(os.path.join(root_dir, d))])
+    with os.scandir(root_dir) as it:
+        return sorted(e.name for e in it if e.is_dir())
 
-def get_files(root_dir, subfolder):
+@st.cache_data(max_entries=256, show_spinner=False)
+def get_files(root_dir, subfolder, mtime_ns):
     """
     Returns a list of specific file types (.tex, .pdf, images) 
-    found inside a specific subfolder.
+    found inside a specific subfolder (cached per folder mtime, like get_subfolders).
     """
     target_path = os.path.join(root_dir, subfolder)
     allowed_extensions = ('.tex', '.pdf', '.jpg', '.jpeg', '.png')
-    # List files, filter by extension, and sort them alphabetically
-    return sorted([f for f in os.listdir(target_path) if f.lower().endswith(allowed_extensions)])
+    # os.scandir lists the folder and already knows which entries are files,
+    # so no extra disk lookup is needed per entry. Filter by extension and sort.
+    with os.scandir(target_path) as it:
+        return sorted(e.name for e in it if e.is_file() and e.name.lower().endswith(allowed_extensions))
+
+# --- AUTO-PULL CHECK ---
+# If the "Topics" folder is missing or empty when the app starts, 
+# automatically try to download everything from GitHub.
+if not os.path.exists(BASE_DIRS["Topics"]) or dir_is_empty(BASE_DIRS["Topics"]):
+    pull_from_github()
+
+# Compiled PDFs are kept in TEMP_DIR as a cache. To stop that folder growing forever:
+PDF_CACHE_TTL = 24 * 3600     # Delete a PDF nobody has opened for 24 hours (in seconds)
+PDF_CACHE_MAX_ENTRIES = 200   # Never keep more than 200 PDFs (the least recently used go first)...
+PDF_IN_USE_SECONDS = 3600     # ...except PDFs used in the last hour: someone may still be reading them
+SWEEP_INTERVAL = 15 * 60      # Clean up at most every 15 minutes (in seconds), not after every compile
+
+@st.cache_resource(show_spinner=False)
+def get_source_keys():
+    """
+    Returns one dictionary shared by every user and every rerun of this server process.
+    It remembers {source_path: (signature, key, inputs)} so we don't re-hash unchanged files.
+    (A plain global dict would be wiped, because Streamlit re-executes this script on every click.)
+    """
+    return {}
+
+# Matches \\input{...}, \\include{...} and \\subfile{...}, capturing the file name inside the braces
+INPUT_COMMANDS = re.compile(rb"\\(?:input|include|subfile)\s*\{([^}]+)\}")
+
+def find_inputs(file_path):
+    """
+    Returns the files a .tex document pulls in with \\input or \\include (and the files
+    those pull in, and so on). Names are relative to the document's folder, and
+    '.tex' is added when no extension is given, just like LaTeX does.
+    Files that don't exist (yet) are listed too: if one appears later, the
+    signature changes and the document is compiled again.
+    """
+    folder = os.path.dirname(file_path)
+    inputs = set()
+    pending = [file_path] # Files still to be searched for \\input commands
+    while pending:
+        with open(pending.pop(), "rb") as f:
+            names = INPUT_COMMANDS.findall(f.read())
+        for name in names:
+            path = os.path.normpath(os.path.join(folder, name.decode("utf-8", "replace").strip()))
+            if not os.path.splitext(path)[1]:
+                path += ".tex"
+            # 'not in inputs' also stops two files that input each other from looping forever
+            if path not in inputs and path != file_path:
+                inputs.add(path)
+                if os.path.isfile(path):
+                    pending.append(path)
+    return sorted(inputs)
+
+def source_signature(file_path, inputs):
+    """
+    A cheap 'signature' of everything a compile reads: the .tex file, its inputs and the
+    images next to it. It is made of modification times and sizes (no file reading needed).
+    A file that has disappeared is recorded with None, so its removal also counts as a change.
+    """
+    with os.scandir(os.path.dirname(file_path)) as it:
+        images = sorted(e.path for e in it if e.name.lower().endswith(IMAGE_EXTENSIONS))
+    signature = []
+    for p in [file_path, *inputs, *images]:
+        try:
+            s = os.stat(p)
+            signature.append((p, s.st_mtime_ns, s.st_size))
+        except FileNotFoundError:
+            signature.append((p, None, None))
+    return tuple(signature)
+
+def get_source_key(file_path):
+    """
+    Returns a short fingerprint (xxHash64) of a .tex file, the files it \\inputs and
+    the images next to it. Two documents with identical content get the same
+    fingerprint, wherever they live; editing an \\input file changes it.
+    """
+    # If nothing changed since we last hashed this file, reuse the previous fingerprint
+    memo = get_source_keys()
+    cached = memo.get(file_path)
+    if cached and cached[0] == source_signature(file_path, cached[2]):
+        return cached[1]
+
+    # Something changed (maybe even which files are \\input), so search for inputs again
+    inputs = find_inputs(file_path)
+    signature = source_signature(file_path, inputs)
+    folder = os.path.dirname(file_path)
+    # Read the bytes and hash them, each file preceded by its name
+    h = xxhash.xxh64()
+    for p, mtime, size in signature:
+        if size is None:
+            continue # Disappeared file: nothing to read
+        h.update(os.path.relpath(p, folder).encode("utf-8"))
+        with open(p, "rb") as f:
+            h.update(f.read())
+    key = h.hexdigest()
+    memo[file_path] = (signature, key, inputs)
+    return key
+
+def remove_quietly(path):
+    """Deletes a file, ignoring the case where it is already gone."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass # Another user's session already removed it
+
+def sweep_build_dir():
+    """
+    Cleans up TEMP_DIR and STATIC_PDF_DIR:
+    1. Deletes any file (or build folder) not used for PDF_CACHE_TTL seconds.
+    2. Keeps only the PDF_CACHE_MAX_ENTRIES most recently used PDFs, but never deletes
+       one used in the last PDF_IN_USE_SECONDS (a user may still be viewing it).
+    A file's modification time (mtime) tells us when it was last built or opened.
+    """
+    now = time.time()
+    for folder in (TEMP_DIR, STATIC_PDF_DIR):
+        pdfs = []
+        with os.scandir(folder) as it:
+            for e in it:
+                if e.is_dir():
+                    if now - e.stat().st_mtime > PDF_CACHE_TTL:
+                        shutil.rmtree(e.path, ignore_errors=True) # A build folder nobody used for a day
+                    continue
+                mtime = e.stat().st_mtime
+                if now - mtime > PDF_CACHE_TTL:
+                    remove_quietly(e.path) # Too old
+                elif e.name.endswith(".pdf") and not e.name.startswith("_build_"):
+                    pdfs.append((mtime, e.path)) # A finished, cached PDF
+        # Newest first; everything after the first PDF_CACHE_MAX_ENTRIES is deleted,
+        # unless it was used recently
+        for mtime, path in sorted(pdfs, reverse=True)[PDF_CACHE_MAX_ENTRIES:]:
+            if now - mtime > PDF_IN_USE_SECONDS:
+                remove_quietly(path)
+
+@st.cache_resource(show_spinner=False)
+def sweep_build_dir_once():
+    """Runs the cleanup once when the server starts (cache_resource remembers it has run)."""
+    sweep_build_dir()
+
+@st.cache_resource
+def get_sweep_state():
+    """
+    Remembers when the cleanup last ran, shared by all users.
+    It starts at 'now', because the server has just run sweep_build_dir_once.
+    The lock makes sure two compiles finishing together don't both start a cleanup.
+    """
+    return {"last": time.time(), "lock": threading.Lock()}
+
+def maybe_sweep_build_dir():
+    """
+    Called after each compile. Scanning the folders every time would be wasted work,
+    so the cleanup only runs if the last one was more than SWEEP_INTERVAL seconds ago.
+    """
+    state = get_sweep_state()
+    with state["lock"]:
+        if time.time() - state["last"] < SWEEP_INTERVAL:
+            return # Cleaned up recently enough
+        state["last"] = time.time()
+    sweep_build_dir()
+
+def latex_env(file_path):
+    """
+    Builds the environment variables for pdflatex.
+    TEXINPUTS is the list of folders TeX searches for \\input files and images:
+    1. The smaller image copies for this file's folder (see optimize_image).
+    2. The folder of the .tex file itself.
+    3. Whatever was set before; an empty entry means "TeX's normal search path".
+    """
+    source_dir = os.path.dirname(os.path.abspath(file_path))
+    cached_dir = os.path.join(os.path.abspath(IMAGE_CACHE_DIR), os.path.relpath(source_dir))
+    return dict(os.environ, TEXINPUTS=os.pathsep.join([cached_dir, source_dir, os.environ.get("TEXINPUTS", "")]))
+
+def run_latex(command, file_path):
+    """
+    Runs a TeX command (pdflatex or latexmk) for file_path and waits for it.
+    The output is read line by line into a deque with a maximum length, which
+    automatically drops the oldest line when full. So however long the log gets,
+    only the last LOG_TAIL_LINES lines are ever kept in memory.
+    Returns a CompletedProcess (the same thing subprocess.run returns), with the tail in .stdout.
+    """
+    # Popen starts the program without waiting, so we can read its output as it arrives
+    with subprocess.Popen(
+        # stderr=STDOUT sends error messages into the same pipe, so there is only one to read
+        # (and they end up in the log we show). bufsize: read the pipe in 64 KB pieces
+        # rather than the default 8 KB, so a long log needs fewer read calls.
+        command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, bufsize=65536,
+        # errors="replace": odd bytes in the log become '?' instead of crashing
+        text=True, errors="replace", env=latex_env(file_path)
+    ) as process:
+        tail = deque(process.stdout, maxlen=LOG_TAIL_LINES)
+    # Leaving the 'with' block waits for the program to finish and sets returncode
+    return subprocess.CompletedProcess(command, process.returncode, "".join(tail))
+
+# Matches '\\begin{document}', where a LaTeX document's preamble ends
+PREAMBLE_END = re.compile(rb"\\begin\s*\{document\}")
+
+@st.cache_resource(show_spinner=False)
+def get_preamble_keys():
+    """
+    Remembers each file's preamble fingerprint, shared by all users:
+    {source_path: ((mtime_ns, size), fingerprint)}. A file is only read again
+    once its modification time or size has changed.
+    """
+    return {}
+
+def preamble_key(file_path):
+    """
+    Returns a fingerprint (xxHash64) of everything before \\begin{document},
+    or None if the file has no \\begin{document}.
+    """
+    memo = get_preamble_keys()
+    s = os.stat(file_path)
+    version = (s.st_mtime_ns, s.st_size)
+    cached = memo.get(file_path)
+    if cached and cached[0] == version:
+        return cached[1] # File unchanged: reuse the fingerprint
+    with open(file_path, "rb") as f:
+        preamble = PREAMBLE_END.split(f.read(), maxsplit=1)
+    key = xxhash.xxh64(preamble[0]).hexdigest() if len(preamble) == 2 else None
+    memo[file_path] = (version, key)
+    return key
+
+def shared_preamble_keys(paths):
+    """
+    Returns the fingerprints of the preambles worth a format of their own: used by at
+    least two of the documents in 'paths', and among the PREAMBLE_FMT_MAX_ENTRIES most
+    common. Building a format costs an extra pdflatex run, so for a preamble only one
+    document uses it would never pay for itself.
+    """
+    counts = Counter() # Counter: a dictionary that counts, e.g. {fingerprint: 3}
+    for path in paths:
+        try:
+            counts[preamble_key(path)] += 1
+        except OSError:
+            pass # The file was deleted meanwhile
+    counts.pop(None, None) # Files without \begin{document} don't count
+    return {key for key, n in counts.most_common(PREAMBLE_FMT_MAX_ENTRIES) if n >= 2}
+
+@st.cache_data(show_spinner=False)
+def get_shared_preamble_keys():
+    """
+    Runs shared_preamble_keys over every .tex file once, and remembers the answer.
+    Without this, every compile would re-check all the documents' preambles, so
+    'Rebuild All' would get slower and slower as the number of documents grows.
+    Pulling from GitHub and saving a file clear it (get_shared_preamble_keys.clear()),
+    because both can change which preambles are shared.
+    """
+    return shared_preamble_keys(list_tex_files())
+
+def trim_preamble_formats():
+    """Deletes all but the PREAMBLE_FMT_MAX_ENTRIES most recently used preamble formats."""
+    with os.scandir(PREAMBLE_FMT_DIR) as it:
+        formats = sorted(
+            ((e.stat().st_mtime, e.path) for e in it if e.name.startswith("preamble_") and e.name.endswith(".fmt")),
+            reverse=True # Newest first
+        )
+    for mtime, path in formats[PREAMBLE_FMT_MAX_ENTRIES:]:
+        remove_quietly(path)
+
+def preamble_format(file_path):
+    """
+    The 'preamble' is everything before \\begin{document}: \\documentclass and all the
+    \\usepackage lines. Loading it is often most of a compile's time.
+    The 'mylatexformat' package can run the preamble once and save LaTeX's memory as a
+    format file (.fmt). Compiling with '-fmt=<that file>' starts from the saved state
+    and skips the preamble entirely.
+    Only preambles that several documents share get a format (see get_shared_preamble_keys).
+    Returns the extra pdflatex arguments, or [] if there is no format for this document.
+    """
+    key = preamble_key(file_path)
+    if key is None or key not in get_shared_preamble_keys():
+        return [] # Not worth a format: compile with the shared spo.fmt instead
+    abs_fmt_dir = os.path.abspath(PREAMBLE_FMT_DIR)
+    os.makedirs(abs_fmt_dir, exist_ok=True)
+    # The format is named after the preamble's fingerprint, so documents with the
+    # same preamble share one format, and editing the body doesn't invalidate it.
+    fmt_name = f"preamble_{key}"
+    fmt_path = os.path.join(abs_fmt_dir, f"{fmt_name}.fmt")
+    if not os.path.exists(fmt_path):
+        # Build under a unique temporary name, then rename, in case two users build it at once
+        job_name = f"_build_{fmt_name}_{threading.get_ident()}"
+        process = run_latex(
+            [
+                # The same safety flags as every other run (no shell commands, stop at the first error)
+                "pdflatex", "-ini", *LATEX_FLAGS,
+                f"-output-directory={abs_fmt_dir}", f"-jobname={job_name}",
+                # Start from the normal LaTeX format, run mylatexformat on our file.
+                # The quotes let TeX read file paths that contain spaces.
+                "&pdflatex", "mylatexformat.ltx", f'"{file_path}"'
+            ],
+            file_path
+        )
+        build_path = os.path.join(abs_fmt_dir, f"{job_name}.fmt")
+        remove_quietly(os.path.join(abs_fmt_dir, f"{job_name}.log")) # Only the output above is shown
+        if process.returncode != 0 or not os.path.exists(build_path):
+            remove_quietly(build_path)
+            return [] # Some preambles can't be dumped; compile the normal way
+        os.replace(build_path, fmt_path)
+        trim_preamble_formats() # Keep the folder from growing without limit
+    else:
+        os.utime(fmt_path) # Mark as recently used, so the trim keeps it
+    return [f"-fmt={fmt_path}"]
+
+def syntax_check(file_path, job_dir, fmt_args):
+    """
+    Runs pdflatex in '-draftmode': it checks the whole document but skips writing the PDF,
+    which makes it noticeably faster. Used to report LaTeX errors early.
+    The .aux file it leaves behind also helps the real compile resolve references.
+    """
+    return run_latex(
+        [
+            "pdflatex",
+            *fmt_args, # Either ["-fmt=..."] or nothing
+            *LATEX_FLAGS,
+            "-draftmode", # Check only, no PDF output
+            f"-output-directory={job_dir}",
+            f"-jobname={BUILD_JOB_NAME}",
+            file_path
+        ],
+        file_path
+    )
+
+def full_build(file_path, job_dir, fmt_args):
+    """Runs the compile that actually writes the PDF."""
+    if LATEXMK:
+        # latexmk repeats pdflatex until cross-references are resolved
+        command = [LATEXMK, "-pdf", f"-outdir={job_dir}"]
+        # -latexoption hands an option through to every pdflatex run latexmk makes
+        command += [f"-latexoption={arg}" for arg in fmt_args + LATEX_FLAGS]
+    else:
+        # Fallback: a single pdflatex pass
+        command = ["pdflatex", *fmt_args, *LATEX_FLAGS, f"-output-directory={job_dir}"]
+    return run_latex(
+        # -outdir / -output-directory: save the PDF in our temp folder
+        command + [f"-jobname={BUILD_JOB_NAME}", file_path],
+        file_path
+    )
+
+# Commands whose output is only known after a previous pass (labels, citations, contents)
+CROSS_REFERENCES = re.compile(rb"\\(?:ref|eqref|pageref|autoref|cref|Cref|nameref|cite|tableofcontents|listoffigures|listoftables)\b")
+
+# Error messages that mean the format file was the problem, not the document: a package
+# loaded again with different options than the format has, or a format that doesn't
+# match this pdflatex (e.g. left over from an older TeX installation)
+FORMAT_FAILURES = re.compile(r"Option clash|can be loaded only once|Fatal format file error|was written by|made by different executable")
+
+def needs_two_passes(file_path):
+    """A quick text search: does this document use any cross-reference commands?"""
+    with open(file_path, "rb") as f:
+        return CROSS_REFERENCES.search(f.read()) is not None
+
+@st.cache_resource
+def get_compile_executor():
+    """
+    Returns a small pool of background worker threads, shared by all users.
+    Compiling in a worker means a slow pdflatex run doesn't freeze the page.
+    """
+    return ThreadPoolExecutor(max_workers=2)
 
+@st.cache_resource
+def get_compile_locks():
+    """
+    Returns a dictionary of locks shared by all users, one per .tex file.
+    A defaultdict creates a new lock the first time a file is looked up.
+    """
+    return defaultdict(threading.Lock)
+
+@st.cache_resource
+def get_prefetch_state():
+    """
+    Returns a one-thread pool for 'speculative' compiles (documents nobody asked for yet)
+    and the set of files currently queued on it, both shared by all users.
+    It is separate from get_compile_executor, so prefetching never makes someone wait
+    for the document they actually clicked.
+    """
+    return ThreadPoolExecutor(max_workers=1), set()
+
+def prefetch_neighbours(files, selected_file, folder):
+    """
+    Starts compiling the .tex files just before and after the selected one in the list.
+    People often read a folder in order, so by the time they click 'next' its PDF is
+    usually already in the cache. compile_latex skips documents that are already cached,
+    and the 'pending' set stops the same file from being queued twice.
+    """
+    pool, pending = get_prefetch_state()
+    i = files.index(selected_file)
+    # files[max(i - 1, 0):i] is the previous file (or nothing), files[i + 1:i + 2] the next
+    for name in files[max(i - 1, 0):i] + files[i + 1:i + 2]:
+        path = absolute_path(os.path.join(folder, name))
+        if name.lower().endswith(".tex") and path not in pending:
+            pending.add(path)
+            # When the compile finishes, take the file off the 'pending' set again
+            pool.submit(compile_latex, path).add_done_callback(lambda _, path=path: pending.discard(path))
+
+# Why not keep one pdflatex running and feed it documents? Because a pdflatex run can only
+# ever produce ONE PDF, and after \documentclass there is no way to 'reset' LaTeX for the
+# next document. Starting a spare pdflatex early doesn't help either: it only loads its
+# format after it has been told what to compile. The spo.fmt format (see FMT_ARGS) is
+# how we make each start faster instead.
 def compile_latex(file_path):
     """
     Runs the 'pdflatex' command to convert a .tex file into a .pdf file.
+    The PDF is saved as '<fingerprint>.pdf', so unchanged files are never compiled twice.
+    Returns (pdf_path, None) on success, or (None, error_log) on failure.
     """
-    file_name = os.path.basename(file_path)
-    job_name = os.path.splitext(file_name)[0]
     abs_temp_dir = os.path.abspath(TEMP_DIR)
     
     try:
-        # subprocess.run executes the command in the system shell
-        process = subprocess.run(
-            [
-                "pdflatex", 
-                "-interaction=nonstopmode", # Don't pause if there are errors
-                f"-output-directory={abs_temp_dir}", # Save the PDF in our temp folder
-                f"-jobname={job_name}",
-                file_path
-            ],
-            stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True
-        )
-        pdf_path = os.path.join(abs_temp_dir, f"{job_name}.pdf")
+        # If this file is already compiling (another click, or another user), wait here.
+        # When the lock is released, step 1 finds the PDF the other compile just made.
+        with get_compile_locks()[file_path]:
+            # 1. CACHE CHECK: if a PDF for this exact content already exists, reuse it
+            key = get_source_key(file_path)
+            pdf_path = os.path.join(abs_temp_dir, f"{key}.pdf")
+            if os.path.exists(pdf_path):
+                os.utime(pdf_path) # 'Touch' the file so the cleanup knows it was used recently
+                return pdf_path, None # Cache hit, no pdflatex needed
+
+            # 2. CACHE MISS: make sure large images have their smaller copies, then
+            # compile in this file's own build folder.
+            optimize_folder_images(os.path.dirname(file_path))
+            # Every .tex file gets a separate folder (named after a fingerprint of its path),
+            # so two files that happen to share a name or content never overwrite each
+            # other's .aux/.log files. The folder is kept, so the next compile of this file
+            # starts from its previous .aux and usually needs fewer passes.
+            job_dir = os.path.join(abs_temp_dir, f"job_{xxhash.xxh64(file_path.encode('utf-8')).hexdigest()}")
+            os.makedirs(job_dir, exist_ok=True)
+            # Use this document's own preamble format if possible, else the shared spo.fmt
+            fmt_args = preamble_format(file_path) or FMT_ARGS
+            # 3. FIRST PASS: documents with \\ref or a table of contents need two passes,
+            # because the first one only collects the numbers into the .aux file.
+            # For those, a quick '-draftmode' pass (no PDF) goes first and shows errors early.
+            # Everything else is compiled straight to PDF in one go.
+            two_pass = needs_two_passes(file_path)
+            first_pass = syntax_check if two_pass else full_build
+            process = first_pass(file_path, job_dir, fmt_args)
+            if process.returncode != 0 and fmt_args and FORMAT_FAILURES.search(process.stdout):
+                # Some documents load a preloaded package with different options, which LaTeX
+                # rejects. Try once more with the normal format before reporting an error.
+                # A real mistake in the document would just fail again, so those are
+                # reported right away (that's what -halt-on-error is for).
+                fmt_args = []
+                process = first_pass(file_path, job_dir, fmt_args)
+            if process.returncode != 0:
+                return None, process.stdout # Failed: show the error log
+
+            # 4. FULL COMPILE (second pass), now that the .aux file exists
+            if two_pass:
+                process = full_build(file_path, job_dir, fmt_args)
+            build_path = os.path.join(job_dir, f"{BUILD_JOB_NAME}.pdf")
         
-        # Check if the command succeeded (returncode 0) and the PDF exists
-        if process.returncode == 0 and os.path.exists(pdf_path):
-            return pdf_path, None # Success
-        else:
-            return None, process.stdout # Failure, return the error log
+            # Check if the command succeeded (returncode 0) and the PDF exists
+            if process.returncode == 0 and os.path.exists(build_path):
+                # Rename it to its cached name in one step, so nobody sees a half-written file
+                os.replace(build_path, pdf_path)
+                maybe_sweep_build_dir() # Make room if the cache is now too big (now and then)
+                return pdf_path, None # Success
+            else:
+                return None, process.stdout # Failure, return the error log
     except Exception as e:
         return None, str(e)
 
+def compile_many(paths):
+    """
+    Compiles a list of .tex files at the same time, one pdflatex per CPU core.
+    Returns a list of (path, pdf_path, error_log) tuples, in the same order as 'paths'.
+    Each document is built in its own folder (see compile_latex), so parallel
+    builds never overwrite each other's .aux files.
+    Threads are enough here: the real work happens in the separate pdflatex processes.
+    """
+    with ThreadPoolExecutor(max_workers=os.cpu_count()) as pool:
+        return [(path, *result) for path, result in zip(paths, pool.map(compile_latex, paths))]
+
+def list_tex_files():
+    """Returns the full path of every .tex file in the Topics and Year folders."""
+    paths = []
+    for folder_name in BASE_DIRS.values():
+        # os.walk visits the folder and every subfolder inside it
+        for root, _, files in os.walk(folder_name):
+            paths += [os.path.abspath(os.path.join(root, f)) for f in files if f.lower().endswith(".tex")]
+    return paths
+
+def warm_preamble_formats(paths):
+    """
+    Builds the preamble formats (see preamble_format) in the background after a sync,
+    so the first time someone opens one of those documents it doesn't wait for that step.
+    Only preambles several documents share get a format, so this is a handful of
+    pdflatex runs (at most PREAMBLE_FMT_MAX_ENTRIES), one per preamble.
+    It runs on the one-thread prefetch pool, not the compile pool: a document someone
+    actually clicked never has to wait behind it.
+    """
+    shared = shared_preamble_keys(paths)
+    representatives = {} # {fingerprint: one document with that preamble}
+    for path in paths:
+        key = preamble_key(path)
+        if key in shared:
+            representatives.setdefault(key, path) # setdefault keeps the first one found
+    def warm():
+        for path in representatives.values():
+            try:
+                preamble_format(path)
+            except OSError:
+                pass # The file was deleted meanwhile; nothing to prepare
+    pool, _ = get_prefetch_state() # The second value (the 'pending' set) isn't needed here
+    pool.submit(warm)
+
+def publish_pdf(pdf_path):
+    """
+    Puts a compiled PDF into STATIC_PDF_DIR and returns the web address it is served at.
+    The viewer's iframe then loads the file straight from Streamlit's web server.
+    The file is named after a random token that only this session knows (stored in
+    st.session_state), never after the document. Each new PDF replaces the previous one.
+    """
+    if "pdf_token" not in st.session_state:
+        # 16 random bytes, written as URL-safe text: impossible to guess
+        st.session_state.pdf_token = secrets.token_urlsafe(16)
+    static_path = os.path.join(STATIC_PDF_DIR, f"{st.session_state.pdf_token}.pdf")
+    # Write under a temporary name first, then rename it into place in one step,
+    # so a browser never receives a half-written file.
+    tmp_path = f"{static_path}.tmp"
+    remove_quietly(tmp_path) # Left over if a previous publish was interrupted
+    try:
+        os.link(pdf_path, tmp_path) # A 'hard link' shares the bytes without copying them
+    except OSError:
+        # Hard links only work within one disk; TEMP_DIR may be the RAM disk, so copy instead
+        shutil.copyfile(pdf_path, tmp_path)
+    os.replace(tmp_path, static_path)
+    # The address stays the same for the whole session, so a '?v=' part naming this
+    # version is added: a new address makes the iframe load the new PDF.
+    # (The web server ignores everything after the '?' when looking up the file.)
+    return f"app/static/pdfs/{st.session_state.pdf_token}.pdf?v={os.path.basename(pdf_path)[:-4]}"
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def read_pdf_bytes(pdf_path, mtime):
+    """
+    Returns the bytes of a PDF file, remembered between reruns.
+    'mtime' (last-modified time) is part of the cache key, so a rebuilt PDF is read again.
+    mmap lets the operating system hand us the file straight from its page cache.
+    """
+    with open(pdf_path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+        return bytes(mm)
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def read_text(path, mtime_ns, size):
+    """
+    Reads a text file, remembered between reruns.
+    Passing the file's modification time (in nanoseconds, so no edit is lost to rounding)
+    and size means an edited file is read again, even if two saves land within the same
+    clock tick.
+    """
+    with open(path, "rb") as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return "" # mmap can't map an empty file, and there is nothing to read anyway
+        # mmap lets us treat the file as if it were already in memory (the operating system
+        # loads it from its own cache). str() decodes the UTF-8 text straight from there,
+        # so we never make a separate copy of the raw bytes first, as f.read() would.
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            text = str(mm, "utf-8")
+    # Windows-style line endings (\r\n) become plain \n, just as open(path, "r") does
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+# Colouring a huge file takes a while and makes the page heavy, so above this size
+# the source is shown as plain text instead.
+HIGHLIGHT_MAX_BYTES = 200 * 1024
+
+@st.cache_data(max_entries=64, show_spinner=False)
+def highlight_tex(path, mtime_ns, size):
+    """
+    Turns a LaTeX source file into colour-highlighted HTML.
+    st.code would redo the highlighting on every rerun; here it is done once per
+    version of the file (mtime_ns is part of the cache key) and the HTML is reused.
+    """
+    text = read_text(path, mtime_ns, size)
+    if len(text.encode("utf-8")) > HIGHLIGHT_MAX_BYTES:
+        # Too big: plain, uncoloured text (escaped so '<' in the source can't break the page)
+        return f"<pre>{html.escape(text)}</pre>"
+    # noclasses=True puts the colours directly on each tag, so no extra stylesheet is needed
+    return highlight(text, TexLexer(), HtmlFormatter(noclasses=True))
+
+@functools.lru_cache(maxsize=256)
+def absolute_path(rel_path):
+    """
+    Turns 'topics/X/file.tex' into a full path like '/app/topics/X/file.tex'.
+    The answer never changes, so lru_cache remembers it instead of working it out each rerun.
+    """
+    return os.path.abspath(rel_path)
+
+def cached_pdf(key):
+    """
+    Returns the compiled PDF for a source fingerprint if it is already in TEMP_DIR,
+    otherwise None. Checked before starting a background compile, so a document that
+    was already built is shown at once.
+    """
+    pdf_path = os.path.join(os.path.abspath(TEMP_DIR), f"{key}.pdf")
+    try:
+        # Updating the modified time marks it as recently used (so the sweep keeps it);
+        # it also tells us in one step whether the file exists
+        os.utime(pdf_path)
+    except FileNotFoundError:
+        return None
+    return pdf_path
+
+def show_compiled(pdf, log):
+    """
+    Stores a compile result (PDF path or None, error log or None) in session state,
+    and publishes the PDF so the viewer's iframe can load it.
+    """
+    st.session_state.current_pdf = pdf
+    st.session_state.current_pdf_mtime = os.path.getmtime(pdf) if pdf else None
+    st.session_state.compilation_error = log
+    st.session_state.current_pdf_url = publish_pdf(pdf) if pdf else None
+
+def download_pdf(file_path, pdf_path, mtime):
+    """
+    Returns the PDF's bytes for the download button. Streamlit only calls this when the
+    button is clicked, which may be long after the PDF was shown. If the cleanup
+    (sweep_build_dir) has deleted the PDF in the meantime, the document is simply
+    compiled again, instead of the download failing.
+    """
+    try:
+        return read_pdf_bytes(pdf_path, mtime)
+    except FileNotFoundError:
+        pdf_path, log = compile_latex(file_path)
+        if pdf_path is None:
+            # The browser shows "Failed to generate file for download"
+            raise RuntimeError(f"{file_path} no longer compiles") from None
+        return read_pdf_bytes(pdf_path, os.path.getmtime(pdf_path))
+
+def read_current_pdf():
+    """
+    Returns the bytes of the PDF this user is looking at, or None if it no longer exists
+    (the cache cleanup may have deleted it). The PDF's mtime was recorded when it was
+    compiled, so a normal rerun doesn't need to ask the disk about the file at all.
+    """
+    try:
+        return read_pdf_bytes(st.session_state.current_pdf, st.session_state.current_pdf_mtime)
+    except FileNotFoundError:
+        return None
+
+# --- BUILD CACHE SWEEP ---
+# Delete stale PDFs left over from earlier runs (only once per server start).
+sweep_build_dir_once()
+
 # ==========================================
 # 🖥️ SIDEBAR NAVIGATION UI
 # ==========================================
@@ -276,11 +1240,23 @@ if current_role == 'admin':
         with st.spinner("Syncing Topics and Year..."):
             success, msg = pull_from_github()
             if success:
+                # Start preparing the documents' preamble formats in the background
+                warm_preamble_formats(list_tex_files())
                 st.sidebar.success(msg)
                 st.rerun() # Refresh app to show new files
             else:
                 st.sidebar.error(msg)
 
+    # Button to compile every document, e.g. after a big pull.
+    # Documents that haven't changed are already cached and finish instantly.
+    if st.sidebar.button("🛠️ Rebuild All"):
+        with st.spinner("Compiling all documents..."):
+            failed = [path for path, pdf, log in compile_many(list_tex_files()) if pdf is None]
+        if failed:
+            st.sidebar.warning(f"{len(failed)} document(s) failed: " + ", ".join(os.path.basename(p) for p in failed))
+        else:
+            st.sidebar.success("All documents compiled.")
+
 # Logout Button
 if st.sidebar.button("Logout", type="secondary"):
     st.session_state.user_role = None
@@ -291,7 +1267,7 @@ browse_mode = st.sidebar.radio("Library Section:", ["Topics", "Year"], horizonta
 current_root_dir = BASE_DIRS[browse_mode] 
 
 # 2. SELECT SUBFOLDER (e.g., 'Kinematics' or '2023')
-subfolders = get_subfolders(current_root_dir)
+subfolders = get_subfolders(current_root_dir, dir_mtime(current_root_dir))
 
 if not subfolders:
     st.sidebar.error(f"No folders found in '{current_root_dir}'.")
@@ -300,7 +1276,10 @@ if not subfolders:
 selected_subfolder = st.sidebar.selectbox(f"Select {browse_mode[:-1]}", subfolders)
 
 # 3. SELECT FILE
-files = get_files(current_root_dir, selected_subfolder)
+files = get_files(
+    current_root_dir, selected_subfolder,
+    dir_mtime(os.path.join(current_root_dir, selected_subfolder))
+)
 
 if not files:
     st.sidebar.warning("No files found.")
@@ -310,7 +1289,7 @@ selected_file = st.sidebar.radio(f"Documents in {selected_subfolder}", files)
 
 # Construct absolute paths for file reading/writing
 rel_path = os.path.join(current_root_dir, selected_subfolder, selected_file).replace("\\", "/")
-abs_path = os.path.abspath(rel_path)
+abs_path = absolute_path(rel_path)
 
 # ==========================================
 # 👁️ MAIN VIEW / EDIT LOGIC
@@ -326,23 +1305,54 @@ is_tex = file_ext == 'tex'
 # We check if the user selected a new file. If so, we reset the PDF view.
 if "force_recompile" not in st.session_state: st.session_state.force_recompile = False
 if "last_processed" not in st.session_state: st.session_state.last_processed = None
+# 'compile_job' holds a Future: a handle to a compile running in the background
+if "compile_job" not in st.session_state: st.session_state.compile_job = None
 
-if st.session_state.last_processed != rel_path or st.session_state.force_recompile:
+# A selection is remembered as (path, content fingerprint). If a sync or push changes the
+# .tex file while it stays selected, the fingerprint changes and it is compiled again.
+# get_source_key only re-reads the file when its size or modification time changed.
+selection = (rel_path, get_source_key(abs_path) if is_tex else None)
+if st.session_state.last_processed != selection or st.session_state.force_recompile:
     st.session_state.current_pdf = None
+    st.session_state.current_pdf_mtime = None
     st.session_state.compilation_error = None
+    st.session_state.current_pdf_url = None # Web address of the published PDF (compiled files only)
+    st.session_state.compile_job = None # Forget any compile for a previously selected file
     
     if is_pdf:
         st.session_state.current_pdf = abs_path
+        st.session_state.current_pdf_mtime = os.path.getmtime(abs_path)
+    elif is_tex and (pdf := cached_pdf(selection[1])):
+        # Already compiled earlier (by anyone): show it right away. No background job,
+        # so no "Compiling..." box and no extra re-run below.
+        # (':=' stores the path in 'pdf' while checking that there is one.)
+        show_compiled(pdf, None)
+        prefetch_neighbours(files, selected_file, os.path.dirname(rel_path))
     elif is_tex:
-        # If it's a LaTeX file, we try to compile it into a PDF immediately
-        with st.spinner(f"Compiling {selected_file}..."):
-            pdf, log = compile_latex(abs_path)
-            st.session_state.current_pdf = pdf
-            st.session_state.compilation_error = log
+        # Not compiled yet: start compiling it in the background
+        st.session_state.compile_job = get_compile_executor().submit(compile_latex, abs_path)
             
-    st.session_state.last_processed = rel_path
+    st.session_state.last_processed = selection
     st.session_state.force_recompile = False
 
+# --- WAIT FOR THE BACKGROUND COMPILE ---
+# Instead of freezing the page, we check every 0.3 s whether the compile has finished.
+# Between checks, the sidebar (topic switch, logout) still responds to clicks.
+if st.session_state.compile_job is not None:
+    if st.session_state.compile_job.done():
+        # Finished: collect the result (PDF path, error log)
+        # ('*' unpacks the pair into show_compiled's two arguments)
+        show_compiled(*st.session_state.compile_job.result())
+        st.session_state.compile_job = None
+        # Readers often go to the next (or previous) document; compile those in the
+        # background while this one is being read
+        prefetch_neighbours(files, selected_file, os.path.dirname(rel_path))
+    else:
+        # Still running: show a status box, wait a moment, then re-run the script to check again
+        st.status(f"Compiling {selected_file}...", state="running", expanded=False)
+        time.sleep(0.3)
+        st.rerun()
+
 # Create Tabs for Viewing and Editing
 tab_label = "✏️ Edit Source" if current_role == 'admin' else "📝 Source Code"
 tab_view, tab_edit = st.tabs(["📄 Document Viewer", tab_label])
@@ -352,16 +1362,35 @@ with tab_view:
     if is_image:
         st.success(f"**{selected_file}** loaded.")
         st.image(abs_path, caption=selected_file, use_container_width=True)
-    elif st.session_state.current_pdf and os.path.exists(st.session_state.current_pdf):
+    # A compiled PDF that was published to the static folder
+    elif st.session_state.current_pdf_url:
         # Layout: Text on left, Download button on right
         col1, col2 = st.columns([6, 1])
         with col1: st.success(f"**{selected_file}** loaded.")
-        with col2:
-            with open(st.session_state.current_pdf, "rb") as f:
-                st.download_button("⬇️ PDF", f, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
+        # A real download button, so the file is saved as '<document>.pdf' (the published
+        # copy is named after the session's random token). Passing a function instead of bytes means
+        # the PDF is only read when someone actually clicks; on_click="ignore" skips the rerun.
+        with col2: st.download_button(
+            "⬇️ PDF", functools.partial(download_pdf, abs_path, st.session_state.current_pdf, st.session_state.current_pdf_mtime),
+            file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary", on_click="ignore"
+        )
+        st.markdown("---")
+        # Show it in an iframe pointing at the same address. The browser downloads the PDF
+        # itself and can cache it (each version has its own address),
+        # instead of the app sending the whole PDF again on every rerun.
+        components.iframe(st.session_state.current_pdf_url, width=820, height=1000)
+    # PDFs from the repo itself aren't published, so their bytes are sent directly.
+    # ':=' stores the PDF bytes in 'pdf_bytes' while checking that they exist.
+    # The download button and the viewer below share these same bytes.
+    elif st.session_state.current_pdf and (pdf_bytes := read_current_pdf()) is not None:
+        col1, col2 = st.columns([6, 1])
+        with col1: st.success(f"**{selected_file}** loaded.")
+        with col2: st.download_button("⬇️ PDF", pdf_bytes, file_name=selected_file.replace('.tex','.pdf'), mime="application/pdf", type="primary")
         st.markdown("---")
-        # Display the PDF inside the browser
-        pdf_viewer(st.session_state.current_pdf, width=800, height=1000)
+        # Display the PDF inside the browser. The viewer component is only imported
+        # here, since published PDFs are shown in an iframe and don't need it.
+        from streamlit_pdf_viewer import pdf_viewer
+        pdf_viewer(pdf_bytes, width=800, height=1000)
     elif st.session_state.compilation_error:
         st.error("⚠️ Compilation Failed")
         with st.expander("Error Log"):
@@ -372,9 +1401,11 @@ with tab_edit:
     if is_image or is_pdf:
         st.info(f"Binary file ({file_ext.upper()}) cannot be edited directly.")
     else:
-        # Read the text file content
-        with open(abs_path, "r", encoding="utf-8") as f:
-            file_content = f.read()
+        # Read the text file content (cached until the file changes)
+        # Look up the file's details once (one system call), used twice below
+        source_stat = os.stat(abs_path)
+        source_version = (source_stat.st_mtime_ns, source_stat.st_size)
+        file_content = read_text(abs_path, *source_version)
 
         if current_role == 'admin':
             st.warning(f"⚠️ You are editing: {rel_path}")
@@ -390,11 +1421,7 @@ with tab_edit:
             # Button to save changes to GitHub
             if st.button("💾 Push to GitHub", type="primary"):
                 if new_content != file_content:
-                    # 1. Save locally first
-                    with open(abs_path, "w", encoding="utf-8") as f:
-                        f.write(new_content)
-                    
-                    # 2. Push to GitHub
+                    # 1. Push to GitHub
                     with st.spinner("Pushing to GitHub..."):
                         success, msg = push_to_github(
                             rel_path, 
@@ -402,7 +1429,15 @@ with tab_edit:
                             f"Update {selected_file} via Streamlit"
                         )
                     if success:
+                        # 2. Save locally, but only now that GitHub has it. If the push
+                        # fails, the local file stays as it was (so the next Pull doesn't
+                        # quietly replace an edit GitHub never got), and the edit is still
+                        # in the text box to try again.
+                        with open(abs_path, "w", encoding="utf-8") as f:
+                            f.write(new_content)
                         st.success(msg)
+                        read_text.clear() # Forget the old text, so nothing stale is kept around
+                        get_shared_preamble_keys.clear() # The edit may have changed the preamble
                         st.session_state.force_recompile = True # Trigger re-compile on reload
                         st.rerun()
                     else:
@@ -412,4 +1447,6 @@ with tab_edit:
         else:
             # Viewers just see the code (read-only)
             st.caption(f"Path: {rel_path}")
-            st.code(file_content, language="latex")
+            # Collapsed by default, so the (possibly long) source only shows when asked for
+            with st.expander("Show source", expanded=False):
+                st.html(highlight_tex(abs_path, *source_version))